@@ -0,0 +1,621 @@
+import contextlib
+import importlib.machinery
+import importlib.util
+import io
+import os
+import pathlib
+import random
+import re
+import select
+import socket
+import sys
+import tempfile
+import unittest
+
+
+def load_module():
+    path = pathlib.Path(__file__).resolve().parents[1] / "discover-folders.py"
+    loader = importlib.machinery.SourceFileLoader("discover_folders", str(path))
+    spec = importlib.util.spec_from_loader(loader.name, loader)
+    assert spec and spec.loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[loader.name] = module
+    spec.loader.exec_module(module)  # type: ignore[attr-defined]
+    return module
+
+
+DF = load_module()
+
+
+class FakeWire:
+    """Scripted IMAP server behind imaplib's low-level calls (_new_tag/send/readline/read).
+
+    'handler(tag, command)' returns the raw response bytes for each command sent.
+    """
+
+    def __init__(self, handler, capabilities=("IMAP4REV1",), list_data=None) -> None:  # noqa: ANN001
+        self.handler = handler
+        self.capabilities = tuple(capabilities)
+        self.list_data = list_data or []
+        self.tag_number = 0
+        self.sent: list[str] = []
+        self.buffer = bytearray()
+        self.max_in_flight = 0
+        self.answered = 0
+
+    def _new_tag(self) -> bytes:
+        self.tag_number += 1
+        return f"A{self.tag_number}".encode()
+
+    def send(self, data: bytes) -> None:
+        tag, command = data.decode().rstrip("\r\n").split(" ", 1)
+        self.sent.append(command)
+        self.buffer += self.handler(tag, command)
+        self.max_in_flight = max(self.max_in_flight, len(self.sent) - self.answered)
+
+    def readline(self) -> bytes:
+        end = self.buffer.find(b"\n") + 1
+        line = bytes(self.buffer[:end])
+        del self.buffer[:end]
+        if re.match(rb"A\d+ ", line):
+            self.answered += 1
+        return line
+
+    def read(self, size: int) -> bytes:
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return data
+
+    def capability(self):  # noqa: ANN201
+        return "OK", [" ".join(self.capabilities).encode()]
+
+    def list(self):  # noqa: ANN201
+        return "OK", self.list_data
+
+
+STATUS_COUNTS = {"INBOX": (12, 3, 4096), "Junk Mail": (7, 7, 2048), 'Say "hi"': (1, 0, 10)}
+
+
+def status_handler(tag: str, command: str) -> bytes:
+    """Answers STATUS for the folders in STATUS_COUNTS (NO for anything else)."""
+    match = re.match(r'STATUS (".*") \((.*)\)$', command)
+    assert match, command
+    name = DF.unquote_imap_string(match.group(1))
+    if name not in STATUS_COUNTS:
+        return f"{tag} NO [NONEXISTENT] no such folder\r\n".encode()
+    counts = dict(zip(("MESSAGES", "UNSEEN", "SIZE"), STATUS_COUNTS[name]))
+    items = " ".join(f"{item} {counts[item]}" for item in match.group(2).split())
+    return f"* STATUS {match.group(1)} ({items})\r\n{tag} OK STATUS done\r\n".encode()
+
+
+class TestFolderInventory(unittest.TestCase):
+    def test_parse_list_and_status_lines(self) -> None:
+        self.assertEqual(
+            DF.parse_list_line('* LIST (\\HasNoChildren \\Junk) "/" "Junk Mail"'),
+            (["\\hasnochildren", "\\junk"], "Junk Mail"),
+        )
+        self.assertEqual(DF.parse_list_line("(\\Noselect) NIL Archive"), (["\\noselect"], "Archive"))
+        self.assertIsNone(DF.parse_list_line("* OK hello"))
+        self.assertEqual(
+            DF.parse_status_line('* STATUS "Say \\"hi\\"" (MESSAGES 5 unseen 2 SIZE 1234)'),
+            ('Say "hi"', {"MESSAGES": 5, "UNSEEN": 2, "SIZE": 1234}),
+        )
+        self.assertEqual(DF.parse_status_line("* STATUS INBOX (MESSAGES x UNSEEN 1)"), ("INBOX", {"UNSEEN": 1}))
+        self.assertIsNone(DF.parse_status_line("* 3 EXISTS"))
+
+    def test_read_response_line_inlines_literals(self) -> None:
+        wire = FakeWire(lambda _tag, _cmd: b"")
+        wire.buffer += b'* LIST () "/" {9}\r\nNew "one"\r\nA1 OK\r\n'
+        self.assertEqual(DF.read_response_line(wire), '* LIST () "/" "New \\"one\\""')
+        self.assertEqual(DF.parse_list_line('* LIST () "/" "New \\"one\\""'), ([], 'New "one"'))
+
+    def test_pipelined_status_keeps_window_in_flight(self) -> None:
+        wire = FakeWire(status_handler)
+        results = DF.pipelined_status(wire, ["INBOX", "Junk Mail", "Gone", 'Say "hi"'], "MESSAGES UNSEEN SIZE", window=2)
+        self.assertEqual(
+            results,
+            {
+                "INBOX": {"MESSAGES": 12, "UNSEEN": 3, "SIZE": 4096},
+                "Junk Mail": {"MESSAGES": 7, "UNSEEN": 7, "SIZE": 2048},
+                "Gone": None,
+                'Say "hi"': {"MESSAGES": 1, "UNSEEN": 0, "SIZE": 10},
+            },
+        )
+        self.assertEqual(len(wire.sent), 4)
+        self.assertEqual(wire.max_in_flight, 2)
+
+    def test_inventory_from_list_status(self) -> None:
+        def handler(tag: str, command: str) -> bytes:
+            self.assertEqual(command, 'LIST "" "*" RETURN (STATUS (MESSAGES UNSEEN SIZE))')
+            return (
+                b'* LIST (\\HasNoChildren) "/" INBOX\r\n* STATUS INBOX (MESSAGES 12 UNSEEN 3 SIZE 4096)\r\n'
+                b'* LIST (\\Noselect) "/" Shared\r\n'
+                b'* LIST () "/" "Junk Mail"\r\n* STATUS "Junk Mail" (MESSAGES 7 UNSEEN 7 SIZE 2048)\r\n'
+                + f"{tag} OK LIST done\r\n".encode()
+            )
+
+        wire = FakeWire(handler, capabilities=("IMAP4REV1", "LIST-STATUS", "STATUS=SIZE"))
+        self.assertEqual(
+            DF.folder_inventory(wire),
+            [
+                {"folder": "INBOX", "messages": 12, "unseen": 3, "size_bytes": 4096, "error": None},
+                {"folder": "Shared", "messages": None, "unseen": None, "size_bytes": None, "error": "not selectable"},
+                {"folder": "Junk Mail", "messages": 7, "unseen": 7, "size_bytes": 2048, "error": None},
+            ],
+        )
+        self.assertEqual(len(wire.sent), 1)
+
+    def test_inventory_falls_back_to_list_and_pipelined_status(self) -> None:
+        list_data = [
+            b'(\\HasNoChildren) "/" INBOX',
+            (b'(\\HasNoChildren) "/" {9}', b'Junk Mail'),
+            b'(\\HasNoChildren) "/" Gone',
+            None,
+        ]
+        wire = FakeWire(status_handler, list_data=list_data)
+        inventory = DF.folder_inventory(wire)
+        # No STATUS=SIZE: SIZE is not requested and size_bytes stays None.
+        self.assertTrue(all(cmd.endswith("(MESSAGES UNSEEN)") for cmd in wire.sent))
+        self.assertEqual(
+            [(e["folder"], e["messages"], e["size_bytes"], e["error"]) for e in inventory],
+            [("INBOX", 12, None, None), ("Junk Mail", 7, None, None), ("Gone", None, None, "STATUS failed")],
+        )
+
+
+class FakeSearchImap:
+    """imaplib-level UID SEARCH/FETCH over a folder of {uid: header bytes} (sequence order = UID order)."""
+
+    def __init__(self, messages: dict[int, bytes], capabilities=("IMAP4REV1",)) -> None:  # noqa: ANN001
+        self.messages = messages
+        self.capabilities = tuple(capabilities)
+        self.commands: list[tuple] = []
+        self.untagged: dict[str, list] = {}
+
+    def seq_range_uids(self, seq_range: str) -> list[int]:
+        uids = sorted(self.messages)
+        first, last = (int(n) for n in seq_range.split(":"))
+        return uids[first - 1 : last]
+
+    def uid(self, command, *args):  # noqa: ANN001, ANN201
+        self.commands.append((command, *args))
+        if command == "SEARCH" and args[0] == "RETURN":
+            self.untagged["ESEARCH"] = [f'(TAG "A1") UID ALL {DF.compress_uids(self.seq_range_uids(args[2]))}'.encode()]
+            return "OK", [None]
+        if command == "SEARCH":
+            return "OK", [" ".join(str(uid) for uid in self.seq_range_uids(args[1])).encode()]
+        if command == "FETCH":
+            data = []
+            for uid in DF.expand_uid_set(args[0]):
+                header = self.messages[uid]
+                data += [(f"{uid} (UID {uid} BODY[HEADER.FIELDS (FROM)] {{{len(header)}}}".encode(), header), b")"]
+            return "OK", data
+        raise AssertionError(command)
+
+    def response(self, code):  # noqa: ANN001, ANN201
+        return code, self.untagged.pop(code, [None])
+
+
+class TestHeaderFetch(unittest.TestCase):
+    def test_uid_sets_round_trip(self) -> None:
+        self.assertEqual(DF.compress_uids([7, 1, 3, 2, "9", 8, 3]), "1:3,7:9")
+        self.assertEqual(DF.compress_uids([5]), "5")
+        self.assertEqual(DF.expand_uid_set("1:3,9,7:6"), [1, 2, 3, 9, 6, 7])
+        self.assertEqual(DF.expand_uid_set(DF.compress_uids(range(10, 20))), list(range(10, 20)))
+
+    def test_newest_uids_searches_only_the_tail(self) -> None:
+        messages = {uid: b"From: a@b\r\n\r\n" for uid in (3, 4, 10, 11, 12, 40)}
+        for capabilities in (("IMAP4REV1",), ("IMAP4REV1", "ESEARCH")):
+            imap = FakeSearchImap(messages, capabilities)
+            self.assertEqual(DF.newest_uids(imap, len(messages), 4), [10, 11, 12, 40], capabilities)
+            self.assertEqual(imap.commands[-1][-1], "3:6")
+            self.assertEqual(DF.newest_uids(imap, len(messages), 50), [3, 4, 10, 11, 12, 40])
+        self.assertEqual(DF.newest_uids(imap, 0, 5), [])
+        self.assertEqual(DF.newest_uids(imap, 6, 0), [])
+
+    def test_fetch_header_fields_in_one_command(self) -> None:
+        messages = {5: b"From: x@y\r\n\r\n", 6: b"From: z@y\r\n\r\n", 9: b"From: q@y\r\n\r\n"}
+        imap = FakeSearchImap(messages)
+        self.assertEqual(DF.fetch_header_fields(imap, [9, 5, 6]), messages)
+        self.assertEqual([c[:2] for c in imap.commands], [("FETCH", "5:6,9")])
+        self.assertEqual(DF.fetch_header_fields(imap, []), {})
+
+    def test_fetch_header_fields_uid_after_literal(self) -> None:
+        class UidLast(FakeSearchImap):
+            def uid(self, command, *args):  # noqa: ANN001, ANN201
+                return "OK", [(b"1 (BODY[HEADER.FIELDS (FROM)] {11}", b"From: a@b\r\n"), b" UID 77)"]
+
+        self.assertEqual(DF.fetch_header_fields(UidLast({}), "77:*"), {77: b"From: a@b\r\n"})
+
+
+SPAMD_RESULT = (
+    "default: True [21.20 / 15.00]; BAYES_SPAM(5.10)[99.99%]; "
+    "R_SPF_FAIL(1.00)[-all]; MIME_GOOD(-0.10)[text/plain]; RCVD_COUNT_ONE(0.00)[1]"
+)
+
+
+class TestSpamReport(unittest.TestCase):
+    def test_parse_spamd_result(self) -> None:
+        is_spam, score, symbols = DF.parse_spamd_result(SPAMD_RESULT)
+        self.assertEqual((is_spam, score), (True, 21.2))
+        self.assertEqual(
+            symbols, [("BAYES_SPAM", 5.1), ("R_SPF_FAIL", 1.0), ("MIME_GOOD", -0.1), ("RCVD_COUNT_ONE", 0.0)]
+        )
+        self.assertEqual(DF.parse_spamd_result("default: False [-1.5 / 15.0]")[:2], (False, -1.5))
+        # No "[score / threshold]" block: symbols are still collected.
+        self.assertEqual(DF.parse_spamd_result("garbled; DKIM_ALLOW(-0.20)"), (None, None, [("DKIM_ALLOW", -0.2)]))
+
+    def test_report_aggregates(self) -> None:
+        report = DF.SpamReport(bucket_width=5.0)
+        report.add({"from": '"Spammer" <x@Spam.example>', "spamd_result": SPAMD_RESULT})
+        report.add({"from": "y@spam.example", "spamd_result": "default: False [3.0 / 15.0]; BAYES_SPAM(2.00)"})
+        # X-Spam-Status only: counted in the histogram, not as an X-Spamd-Result.
+        report.add({"from": "ham@good.example", "spam_status": "No, score=-2.5 required=5.0"})
+        report.add({"from": "undisclosed-recipients:;"})
+        result = report.to_dict(top=2)
+
+        self.assertEqual((result["messages"], result["with_spamd_result"], result["flagged_spam"]), (4, 2, 1))
+        self.assertEqual(
+            result["symbols"],
+            [
+                {"symbol": "BAYES_SPAM", "hits": 2, "percent": 100.0, "avg_score": 3.55},
+                {"symbol": "R_SPF_FAIL", "hits": 1, "percent": 50.0, "avg_score": 1.0},
+            ],
+        )
+        self.assertEqual(
+            result["score_histogram"],
+            [
+                {"from": -5.0, "to": 0.0, "count": 1},
+                {"from": 0.0, "to": 5.0, "count": 1},
+                {"from": 20.0, "to": 25.0, "count": 1},
+            ],
+        )
+        self.assertEqual(result["sender_domains"][0], {"domain": "spam.example", "count": 2})
+        self.assertEqual(report.domains.counts["(none)"], 1)
+
+    def test_iter_folder_headers_in_sequence_batches(self) -> None:
+        class Folder:
+            def __init__(self) -> None:
+                self.ranges: list[str] = []
+
+            def fetch(self, seq_range, _items):  # noqa: ANN001, ANN201
+                self.ranges.append(seq_range)
+                first, last = (int(n) for n in seq_range.split(":"))
+                return "OK", [(f"{n} (UID {n * 10} BODY[] {{3}}".encode(), b"h%d" % n) for n in range(first, last + 1)]
+
+        imap = Folder()
+        headers = list(DF.iter_folder_headers(imap, 5, batch_size=2))
+        self.assertEqual(imap.ranges, ["1:2", "3:4", "5:5"])
+        self.assertEqual(headers, [(10, b"h1"), (20, b"h2"), (30, b"h3"), (40, b"h4"), (50, b"h5")])
+
+
+class FakeMailbox:
+    """One folder as seen through imaplib: SELECT responses, UID SEARCH and UID FETCH of headers."""
+
+    def __init__(
+        self, uidvalidity: int, messages: dict[int, str], capabilities=("IMAP4REV1", "CONDSTORE", "ENABLE")  # noqa: ANN001
+    ) -> None:
+        self.uidvalidity = uidvalidity
+        self.messages = dict(messages)
+        self.capabilities = tuple(capabilities)
+        self.modseq = 1
+        self.commands: list[tuple] = []
+        self.untagged: dict[str, list] = {}
+
+    def deliver(self, uid: int, subject: str) -> None:
+        self.messages[uid] = subject
+        self.modseq += 1
+
+    def expunge(self, uid: int) -> None:
+        del self.messages[uid]
+        self.modseq += 1
+
+    def enable(self, _capability):  # noqa: ANN001, ANN201
+        return "OK", [b"CONDSTORE"]
+
+    def select(self, _name, readonly=False):  # noqa: ANN001, ANN201
+        self.commands.append(("SELECT",))
+        self.untagged = {
+            "UIDVALIDITY": [str(self.uidvalidity).encode()],
+            "UIDNEXT": [str(max(self.messages, default=0) + 1).encode()],
+            "HIGHESTMODSEQ": [str(self.modseq).encode()],
+        }
+        return "OK", [str(len(self.messages)).encode()]
+
+    def response(self, code):  # noqa: ANN001, ANN201
+        return code, self.untagged.pop(code, [None])
+
+    def uid(self, command, *args):  # noqa: ANN001, ANN201
+        self.commands.append((command, args[-1] if command == "SEARCH" else args[0]))
+        if command == "SEARCH":
+            uids = sorted(self.messages)
+            if args[-1] != "ALL":
+                low = int(args[-1].split()[1].split(":")[0])
+                # "n:*" always matches the highest UID
+                uids = [uid for uid in uids if uid >= low] or uids[-1:]
+            return "OK", [" ".join(map(str, uids)).encode()]
+        if command == "FETCH":
+            data = []
+            for uid in DF.expand_uid_set(args[0].replace("*", str(max(self.messages, default=0)))):
+                if uid not in self.messages:
+                    continue
+                header = f"Subject: {self.messages[uid]}\r\nFrom: a@b.example\r\n\r\n".encode()
+                data += [(f"{uid} (UID {uid} BODY[HEADER.FIELDS (SUBJECT)] {{{len(header)}}}".encode(), header), b")"]
+            return "OK", data
+        raise AssertionError(command)
+
+
+class TestHeaderCache(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cache = DF.HeaderCache(os.path.join(self.tmp.name, "sub", "cache.sqlite"))
+
+    def tearDown(self) -> None:
+        self.cache.close()
+        self.tmp.cleanup()
+
+    def sync(self, mailbox: FakeMailbox):  # noqa: ANN201
+        mailbox.commands.clear()
+        with contextlib.redirect_stderr(io.StringIO()):
+            return DF.sync_folder_cache(mailbox, self.cache, "u@x", "INBOX", batch_size=2)
+
+    def subjects(self, uidvalidity: int) -> dict[int, str]:
+        return {uid: summary["subject"] for uid, summary in self.cache.summaries("u@x", "INBOX", uidvalidity)}
+
+    def test_incremental_sync(self) -> None:
+        mailbox = FakeMailbox(100, {1: "one", 2: "two", 5: "five"})
+        self.assertEqual(self.sync(mailbox), (100, 3))
+        self.assertEqual(self.subjects(100), {1: "one", 2: "two", 5: "five"})
+        self.assertEqual([c for c in mailbox.commands if c[0] == "FETCH"], [("FETCH", "1:2"), ("FETCH", "5")])
+
+        # Unchanged HIGHESTMODSEQ and count: nothing but the SELECT.
+        self.assertEqual(self.sync(mailbox), (100, 3))
+        self.assertEqual(mailbox.commands, [("SELECT",)])
+
+        # New mail: only UIDs above the cached maximum are fetched.
+        mailbox.deliver(7, "seven")
+        self.sync(mailbox)
+        self.assertEqual(mailbox.commands[1:], [("SEARCH", "UID 6:*"), ("FETCH", "7")])
+        self.assertEqual([uid for uid, _ in self.cache.summaries("u@x", "INBOX", 100, newest=2)], [7, 5])
+
+        # An expunge shows up as a count mismatch and is reconciled with one UID SEARCH ALL.
+        mailbox.expunge(2)
+        self.sync(mailbox)
+        self.assertIn(("SEARCH", "ALL"), mailbox.commands)
+        self.assertEqual(self.subjects(100), {1: "one", 5: "five", 7: "seven"})
+        self.assertEqual(self.cache.folder_state("u@x", "INBOX")["message_count"], 3)
+
+    def test_uidvalidity_change_rebuilds_folder(self) -> None:
+        self.sync(FakeMailbox(100, {1: "old one", 2: "old two"}))
+        # Folder recreated: UID 1 now names a different message.
+        mailbox = FakeMailbox(200, {1: "new one"})
+        self.assertEqual(self.sync(mailbox), (200, 1))
+        self.assertEqual(self.subjects(200), {1: "new one"})
+        self.assertEqual(self.subjects(100), {})
+        self.assertEqual(self.cache.folder_state("u@x", "INBOX")["uidvalidity"], 200)
+
+    def test_without_condstore_uidnext_decides(self) -> None:
+        mailbox = FakeMailbox(100, {1: "one"}, capabilities=("IMAP4REV1",))
+        self.sync(mailbox)
+        self.assertIsNone(self.cache.folder_state("u@x", "INBOX")["highestmodseq"])
+        self.sync(mailbox)
+        self.assertEqual(mailbox.commands, [("SELECT",)])
+        mailbox.deliver(2, "two")
+        self.sync(mailbox)
+        self.assertEqual(self.subjects(100), {1: "one", 2: "two"})
+
+
+class TestTopCounter(unittest.TestCase):
+    def test_exact_below_capacity(self) -> None:
+        counter = DF.TopCounter(capacity=3)
+        for key in ["a", "b", "a", "c", "a", "b"]:
+            counter.add(key)
+        self.assertEqual(counter.most_common(3), [("a", 3), ("b", 2), ("c", 1)])
+
+    def test_newcomer_inherits_smallest_count(self) -> None:
+        counter = DF.TopCounter(capacity=2)
+        for key in ["a", "a", "a", "b", "b", "c"]:
+            counter.add(key)
+        # "b" (2) is the smallest counter; "c" replaces it with 2 + 1.
+        self.assertEqual(counter.counts, {"a": 3, "c": 3})
+        counter.add("d")
+        self.assertEqual(len(counter.counts), 2)
+        self.assertEqual(sorted(counter.counts.values()), [3, 4])
+
+    def test_heavy_hitters_survive_high_cardinality(self) -> None:
+        rng = random.Random(7)
+        keys = ["heavy1"] * 3000 + ["heavy2"] * 2000 + [f"rare{rng.randrange(5000)}" for _ in range(20000)]
+        rng.shuffle(keys)
+        counter = DF.TopCounter(capacity=50)
+        for key in keys:
+            counter.add(key)
+        # Space-Saving invariants: once full, counts sum to the stream length and never undercount.
+        self.assertEqual(len(counter.counts), 50)
+        self.assertEqual(sum(counter.counts.values()), len(keys))
+        self.assertEqual([k for k, _ in counter.most_common(2)], ["heavy1", "heavy2"])
+        self.assertGreaterEqual(counter.counts["heavy1"], 3000)
+        self.assertGreaterEqual(counter.counts["heavy2"], 2000)
+        # Outdated heap entries are compacted away.
+        self.assertLessEqual(len(counter.heap), 4 * 50)
+
+
+class FakeFollowMailbox(FakeMailbox):
+    """A FakeMailbox reachable through connect_to_imap, without IDLE so open() does not block."""
+
+    def capability(self):  # noqa: ANN201
+        return "OK", [b"IMAP4REV1"]
+
+    def logout(self):  # noqa: ANN201
+        return "BYE", [b""]
+
+
+class FakeIdleImap:
+    """Just enough of an IMAP connection for reading IDLE events off a socket pair."""
+
+    def __init__(self, sock) -> None:  # noqa: ANN001
+        self.sock = sock
+        self.file = sock.makefile("rb")
+
+    def socket(self):  # noqa: ANN201
+        return self.sock
+
+    def readline(self) -> bytes:
+        return self.file.readline()
+
+
+class TestFolderFollower(unittest.TestCase):
+    def setUp(self) -> None:
+        self.saved = DF.connect_to_imap
+        self.mailbox = FakeFollowMailbox(7, {1: "one", 2: "two", 3: "three"})
+        DF.connect_to_imap = lambda *args: self.mailbox
+
+    def tearDown(self) -> None:
+        DF.connect_to_imap = self.saved
+
+    def follower(self):  # noqa: ANN201
+        return DF.FolderFollower("INBOX", "user@example.com", "pw", "mx.test")
+
+    def test_first_open_reports_nothing(self) -> None:
+        follower = self.follower()
+        self.assertEqual(follower.open(), [])
+        self.assertEqual(follower.last_uid, 3)
+        self.assertEqual(follower.fetch_new(), [])
+
+    def test_reconnect_reports_mail_delivered_while_down(self) -> None:
+        follower = self.follower()
+        follower.open()
+        follower.close()
+        self.mailbox.deliver(4, "four")
+        self.mailbox.deliver(5, "five")
+        missed = follower.open()
+        self.assertEqual([(uid, summary["subject"]) for uid, summary in missed], [(4, "four"), (5, "five")])
+        self.assertEqual(follower.last_uid, 5)
+        follower.close()
+        self.assertEqual(follower.open(), [])
+
+    def test_reconnect_without_new_mail_sends_no_fetch(self) -> None:
+        follower = self.follower()
+        follower.open()
+        follower.close()
+        self.mailbox.commands.clear()
+        self.assertEqual(follower.open(), [])
+        self.assertEqual(self.mailbox.commands, [("SELECT",)])
+
+    def test_uidvalidity_change_restarts_from_the_top(self) -> None:
+        follower = self.follower()
+        follower.open()
+        follower.close()
+        self.mailbox.uidvalidity = 8
+        self.mailbox.messages = {1: "rebuilt", 2: "rebuilt", 3: "rebuilt", 4: "rebuilt"}
+        self.assertEqual(follower.open(), [])
+        self.assertEqual(follower.last_uid, 4)
+
+    def test_read_event_recognises_new_mail(self) -> None:
+        left, right = socket.socketpair()
+        with left, right:
+            follower = self.follower()
+            follower.imap = FakeIdleImap(left)
+            right.sendall(b"* 3 EXPUNGE\r\n* 4 EXISTS\r\n* 1 RECENT\r\n")
+            self.assertEqual([follower.read_event() for _ in range(3)], [False, True, True])
+            right.close()
+            with self.assertRaises(DF.imaplib.IMAP4.abort):
+                follower.read_event()
+
+    def test_buffered_idle_line_is_seen_without_select(self) -> None:
+        left, right = socket.socketpair()
+        with left, right:
+            follower = self.follower()
+            follower.imap = FakeIdleImap(left)
+            self.assertFalse(follower.has_buffered_data())
+            right.sendall(b"+ idling\r\n* 4 EXISTS\r\n")
+            self.assertEqual(follower.imap.readline(), b"+ idling\r\n")
+            # The EXISTS line now sits in the file buffer, where select() cannot see it
+            self.assertEqual(select.select([left], [], [], 0)[0], [])
+            self.assertTrue(follower.has_buffered_data())
+            self.assertTrue(follower.read_event())
+            self.assertFalse(follower.has_buffered_data())
+            self.assertIsNone(left.gettimeout())
+
+class FakeLoginImap:
+    """Stands in for imaplib.IMAP4_SSL and records how the session was authenticated."""
+
+    instances: list["FakeLoginImap"] = []
+    reject = False
+
+    def __init__(self, host, port) -> None:  # noqa: ANN001
+        self.host, self.port = host, port
+        self.login_args = None
+        self.sasl = None
+        self.shut_down = False
+        FakeLoginImap.instances.append(self)
+
+    def login(self, user, password):  # noqa: ANN001, ANN201
+        self.login_args = (user, password)
+        return "OK", [b"Logged in"]
+
+    def authenticate(self, mechanism, authobject):  # noqa: ANN001, ANN201
+        self.sasl = (mechanism, authobject(b""))
+        if FakeLoginImap.reject:
+            raise DF.imaplib.IMAP4.error("AUTHENTICATE failed")
+        return "OK", [b"Logged in"]
+
+    def shutdown(self) -> None:
+        self.shut_down = True
+
+
+class TestAccounts(unittest.TestCase):
+    def setUp(self) -> None:
+        self.saved = DF.imaplib.IMAP4_SSL
+        DF.imaplib.IMAP4_SSL = FakeLoginImap
+        FakeLoginImap.instances = []
+        FakeLoginImap.reject = False
+
+    def tearDown(self) -> None:
+        DF.imaplib.IMAP4_SSL = self.saved
+
+    def test_read_accounts_file(self) -> None:
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "accounts.txt")
+            with open(path, "w") as handle:
+                handle.write("# migrated mailboxes\n"
+                             "\n"
+                             "  alice@example.com  \n"
+                             "bob@example.com:s3cr:et\n"
+                             "carol@example.com:\n")
+            self.assertEqual(DF.read_accounts_file(path), [
+                ("alice@example.com", None),
+                ("bob@example.com", "s3cr:et"),
+                ("carol@example.com", ""),
+            ])
+
+    def test_own_password_uses_plain_login(self) -> None:
+        DF.connect_as_user("bob@example.com", "mx.test", "pw", "master", "mpw")
+        (imap,) = FakeLoginImap.instances
+        self.assertEqual((imap.host, imap.port), ("mx.test", 993))
+        self.assertEqual(imap.login_args, ("bob@example.com", "pw"))
+        self.assertIsNone(imap.sasl)
+
+    def test_master_user_login_is_sasl_plain_with_authzid(self) -> None:
+        DF.connect_as_user("alice@example.com", "mx.test", None, "master", "mpw")
+        (imap,) = FakeLoginImap.instances
+        self.assertIsNone(imap.login_args)
+        self.assertEqual(imap.sasl, ("PLAIN", b"alice@example.com\0master\0mpw"))
+
+    def test_rejected_master_login_closes_socket(self) -> None:
+        FakeLoginImap.reject = True
+        with self.assertRaises(DF.imaplib.IMAP4.error):
+            DF.connect_as_user("alice@example.com", "mx.test", "", "master", "mpw")
+        (imap,) = FakeLoginImap.instances
+        self.assertTrue(imap.shut_down)
+
+    def test_login_failure_becomes_error_row(self) -> None:
+        FakeLoginImap.reject = True
+        with contextlib.redirect_stderr(io.StringIO()):
+            rows = DF.inventory_accounts([("alice@example.com", None)], "mx.test", "master", "mpw")
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0]["account"], "alice@example.com")
+        self.assertIsNone(rows[0]["folder"])
+        self.assertTrue(rows[0]["error"].startswith("login failed:"))
+
+
+if __name__ == "__main__":
+    unittest.main()
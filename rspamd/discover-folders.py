@@ -1,8 +1,20 @@
 #!/usr/bin/env python3
 # List all your IMAP folders and their message counts
 import imaplib
+import os
 import re
+import select
+import ssl
+import sys
+import time
+import sqlite3
+import csv
+import json
 import argparse
+import email
+import heapq
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import email.utils
 from email.header import decode_header
 
 def connect_to_imap(username='user@example.com', password='ChangeMe', server='mx.example.com'):
@@ -11,113 +23,466 @@ def connect_to_imap(username='user@example.com', password='ChangeMe', server='mx
     imap.login(username, password)
     return imap
 
-def list_folders(username='user@example.com', password='ChangeMe', server='mx.example.com'):
-    """List all IMAP folders and their message counts."""
-    imap = connect_to_imap(username, password, server)
+def connect_as_user(username, server='mx.example.com', password=None, master_user=None, master_password=None):
+    """Log in as 'username', with its own password if given, otherwise via a master user.
 
-    # List all folders
-    status, folders = imap.list()
-    print("Your IMAP folders and message counts:")
-    print("-" * 60)
-
-    for folder in folders:
-        folder_info = folder.decode()
-
-        # Properly extract the folder name from the IMAP LIST response
-        # Format is: * LIST (\Attributes) "delimiter" "folder name"
-        # Find all quoted strings and take the last one (the folder name)
-        matches = re.findall(r'"([^"]*)"', folder_info)
-        if len(matches) >= 2:
-            folder_name = matches[-1]  # Get the last quoted string (the folder name)
-            delimiter = matches[-2]    # Second to last is typically the delimiter
-        elif len(matches) == 1:
-            folder_name = matches[0]   # If only one quoted string, it might be the folder name
-        else:
-            # Fallback: extract the last part after splitting
-            parts = folder_info.split()
-            folder_name = parts[-1] if parts else "Unknown"
+    With a master user the login is SASL PLAIN with authzid=username and the
+    master credentials as authcid/password, so no per-user password is needed.
+    """
+    if password or not master_user:
+        return connect_to_imap(username, password, server)
+    imap = imaplib.IMAP4_SSL(server, 993)
+    try:
+        imap.authenticate('PLAIN', lambda _: f"{username}\0{master_user}\0{master_password}".encode())
+    except imaplib.IMAP4.error:
+        imap.shutdown()
+        raise
+    return imap
 
-        # Count messages in the folder
+def read_accounts_file(path):
+    """Read accounts from a file: one 'user' or 'user:password' per line, '#' comments allowed."""
+    accounts = []
+    with open(path) as handle:
+        for line in handle:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            user, sep, password = line.partition(':')
+            accounts.append((user.strip(), password if sep else None))
+    return accounts
+
+def account_inventory(username, password, server, master_user=None, master_password=None):
+    """STATUS inventory for one account; connection or login failures become a single error row."""
+    try:
+        imap = connect_as_user(username, server, password, master_user, master_password)
+    except Exception as e:
+        return [{'account': username, 'folder': None, 'messages': None, 'unseen': None,
+                 'size_bytes': None, 'error': f"login failed: {e}"}]
+    try:
+        return [dict(account=username, **entry) for entry in folder_inventory(imap)]
+    except Exception as e:
+        return [{'account': username, 'folder': None, 'messages': None, 'unseen': None,
+                 'size_bytes': None, 'error': str(e)}]
+    finally:
         try:
-            # Use square brackets around folder name to ensure proper quoting if there are special characters
-            # Properly handle folder selection with correct quoting
-            result = imap.select(f'"{folder_name}"')
-            if result[0] == 'OK':
-                # Search for all messages
-                status, messages = imap.search(None, 'ALL')
-                message_count = len(messages[0].split()) if messages[0] and messages[0].strip() else 0
-
-                print(f"{folder_name:<30} : {message_count} messages")
-            else:
-                print(f"{folder_name:<30} : Unable to select folder")
-        except:
-            # If the quoted version fails, try the raw version (some servers handle it differently)
-            try:
-                result = imap.select(folder_name)
-                if result[0] == 'OK':
-                    # Search for all messages
-                    status, messages = imap.search(None, 'ALL')
-                    message_count = len(messages[0].split()) if messages[0] and messages[0].strip() else 0
-
-                    print(f"{folder_name:<30} : {message_count} messages")
-                else:
-                    print(f"{folder_name:<30} : Unable to select folder")
-            except Exception as e:
-                print(f"{folder_name:<30} : Error - {str(e)}")
+            imap.logout()
+        except Exception:
+            pass
+
+def inventory_accounts(accounts, server, master_user=None, master_password=None, workers=8):
+    """Run folder inventories for many accounts on a bounded thread pool; rows keep file order."""
+    results = [None] * len(accounts)
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = {
+            pool.submit(account_inventory, user, password, server, master_user, master_password): index
+            for index, (user, password) in enumerate(accounts)
+        }
+        for done, future in enumerate(as_completed(futures), 1):
+            results[futures[future]] = future.result()
+            print(f"  inventoried {done}/{len(accounts)} accounts", end='\r', file=sys.stderr)
+    if accounts:
+        print(file=sys.stderr)
+    return [row for rows in results for row in rows]
+
+def print_account_inventory(rows, output_format='table'):
+    """Print a multi-account inventory with per-account and grand totals."""
+    if output_format == 'json':
+        print(json.dumps(rows, indent=2))
+        return
+
+    if output_format == 'csv':
+        writer = csv.DictWriter(sys.stdout, fieldnames=['account', 'folder', 'messages', 'unseen', 'size_bytes', 'error'])
+        writer.writeheader()
+        writer.writerows(rows)
+        return
+
+    print(f"{'Account':<40} {'Folders':>8} {'Messages':>10} {'Unseen':>10} {'Size':>12}")
+    print("-" * 84)
+    totals = {}
+    order = []
+    for row in rows:
+        account = row['account']
+        if account not in totals:
+            totals[account] = {'folders': 0, 'messages': 0, 'unseen': 0, 'size': 0, 'sized': False, 'error': None}
+            order.append(account)
+        entry = totals[account]
+        if row['folder'] is None:
+            entry['error'] = row['error']
+            continue
+        if row['error']:
+            continue
+        entry['folders'] += 1
+        entry['messages'] += row['messages'] or 0
+        entry['unseen'] += row['unseen'] or 0
+        if row['size_bytes'] is not None:
+            entry['size'] += row['size_bytes']
+            entry['sized'] = True
+
+    grand = {'folders': 0, 'messages': 0, 'unseen': 0, 'size': 0}
+    failed = 0
+    for account in order:
+        entry = totals[account]
+        if entry['error']:
+            failed += 1
+            print(f"{account:<40} {entry['error']}")
+            continue
+        for key in grand:
+            grand[key] += entry[key]
+        size = format_size(entry['size'] if entry['sized'] else None)
+        print(f"{account:<40} {entry['folders']:>8} {entry['messages']:>10} {entry['unseen']:>10} {size:>12}")
+    print("-" * 84)
+    print(f"{f'Total ({len(order) - failed} accounts)':<40} {grand['folders']:>8} {grand['messages']:>10} "
+          f"{grand['unseen']:>10} {format_size(grand['size'] if any(totals[a]['sized'] for a in order) else None):>12}")
+    if failed:
+        print(f"{failed} account(s) could not be inventoried")
+
+def refresh_capabilities(imap):
+    """Re-read CAPABILITY after login; servers often advertise more once authenticated."""
+    status, data = imap.capability()
+    if status == 'OK' and data and data[-1]:
+        imap.capabilities = tuple(data[-1].decode().upper().split())
+    return imap.capabilities
+
+def quote_mailbox(name):
+    """Quote a mailbox name for use as an IMAP quoted string."""
+    return '"' + name.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+def unquote_imap_string(value):
+    """Turn an IMAP quoted string or atom back into a plain string."""
+    if len(value) >= 2 and value[0] == '"' and value[-1] == '"':
+        return re.sub(r'\\(.)', r'\1', value[1:-1])
+    return value
 
-    imap.close()
-    imap.logout()
-    print("-" * 60)
+def read_response_line(imap):
+    """Read one complete server response line, inlining any {n} literals it carries."""
+    line = imap.readline()
+    if not line:
+        raise imaplib.IMAP4.abort('connection closed by server')
+    while True:
+        match = re.search(rb'\{(\d+)\}\r\n$', line)
+        if not match:
+            return line.rstrip(b'\r\n').decode('utf-8', errors='replace')
+        literal = imap.read(int(match.group(1))).decode('utf-8', errors='replace')
+        rest = imap.readline()
+        line = line[:match.start()] + quote_mailbox(literal).encode() + rest
+
+LIST_RE = re.compile(r'^(?:\* LIST )?\((?P<flags>[^)]*)\) (?P<delim>"(?:[^"\\]|\\.)*"|NIL) (?P<name>.+)$', re.I)
+STATUS_RE = re.compile(r'^\* STATUS (?P<name>"(?:[^"\\]|\\.)*"|\S+) \((?P<items>[^)]*)\)', re.I)
+
+def parse_list_line(line):
+    """Parse a LIST response line into (flags, folder name); returns None if it does not match."""
+    match = LIST_RE.match(line)
+    if not match:
+        return None
+    flags = [flag.lower() for flag in match.group('flags').split()]
+    return flags, unquote_imap_string(match.group('name').strip())
+
+def parse_status_line(line):
+    """Parse an untagged STATUS response into (folder name, {item: value})."""
+    match = STATUS_RE.match(line)
+    if not match:
+        return None
+    items = match.group('items').split()
+    counts = {}
+    for i in range(0, len(items) - 1, 2):
+        try:
+            counts[items[i].upper()] = int(items[i + 1])
+        except ValueError:
+            pass
+    return unquote_imap_string(match.group('name')), counts
+
+def pipelined_status(imap, folder_names, items, window=64):
+    """Issue STATUS for many folders without waiting for each reply.
+
+    Up to 'window' tagged commands are kept in flight; replies are matched
+    back to folders by the mailbox name in the untagged STATUS response.
+    Folders whose STATUS was rejected map to None.
+    """
+    results = {}
+    pending = {}
+    queue = list(folder_names)
+    while queue or pending:
+        while queue and len(pending) < window:
+            name = queue.pop(0)
+            tag = imap._new_tag()
+            imap.send(tag + f' STATUS {quote_mailbox(name)} ({items})\r\n'.encode())
+            pending[tag.decode()] = name
+
+        line = read_response_line(imap)
+        if line.upper().startswith('* STATUS '):
+            parsed = parse_status_line(line)
+            if parsed:
+                results[parsed[0]] = parsed[1]
+            continue
+
+        tag, _, rest = line.partition(' ')
+        if tag in pending:
+            name = pending.pop(tag)
+            if not rest.upper().startswith('OK'):
+                results[name] = None
+    return results
+
+def list_status(imap, items):
+    """Fetch every folder and its counters with a single LIST-STATUS command (RFC 5819)."""
+    folders = []
+    results = {}
+    tag = imap._new_tag()
+    imap.send(tag + f' LIST "" "*" RETURN (STATUS ({items}))\r\n'.encode())
+    while True:
+        line = read_response_line(imap)
+        upper = line.upper()
+        if upper.startswith('* LIST '):
+            parsed = parse_list_line(line)
+            if parsed:
+                folders.append(parsed)
+        elif upper.startswith('* STATUS '):
+            parsed = parse_status_line(line)
+            if parsed:
+                results[parsed[0]] = parsed[1]
+        elif line.startswith(tag.decode() + ' '):
+            if not upper.split(' ', 1)[1].startswith('OK'):
+                raise imaplib.IMAP4.error(line)
+            return folders, results
+
+def folder_inventory(imap):
+    """Return a list of dicts with message, unseen and byte counts for every folder.
+
+    Uses LIST-STATUS when the server offers it, otherwise one LIST followed
+    by pipelined STATUS commands.  SIZE is only requested when the server
+    advertises STATUS=SIZE (RFC 8438); otherwise size_bytes is None.
+    """
+    capabilities = refresh_capabilities(imap)
+    items = 'MESSAGES UNSEEN SIZE' if 'STATUS=SIZE' in capabilities else 'MESSAGES UNSEEN'
+
+    folders = None
+    results = {}
+    if 'LIST-STATUS' in capabilities:
+        try:
+            folders, results = list_status(imap, items)
+        except imaplib.IMAP4.error:
+            folders = None
+
+    if folders is None:
+        status, data = imap.list()
+        folders = []
+        for entry in data or []:
+            if entry is None:
+                continue
+            if isinstance(entry, tuple):
+                # Folder name sent as a literal: (b'(flags) "/" {n}', b'name')
+                entry = entry[0].rsplit(b' ', 1)[0] + b' ' + quote_mailbox(entry[1].decode()).encode()
+            parsed = parse_list_line(entry.decode('utf-8', errors='replace'))
+            if parsed:
+                folders.append(parsed)
+        selectable = [name for flags, name in folders if '\\noselect' not in flags and '\\nonexistent' not in flags]
+        results = pipelined_status(imap, selectable, items)
+
+    inventory = []
+    for flags, name in folders:
+        counts = results.get(name)
+        if '\\noselect' in flags or '\\nonexistent' in flags:
+            error = 'not selectable'
+        elif counts is None:
+            error = 'STATUS failed'
+        else:
+            error = None
+        counts = counts or {}
+        inventory.append({
+            'folder': name,
+            'messages': counts.get('MESSAGES'),
+            'unseen': counts.get('UNSEEN'),
+            'size_bytes': counts.get('SIZE'),
+            'error': error,
+        })
+    return inventory
+
+def format_size(size):
+    """Human readable byte size."""
+    if size is None:
+        return '-'
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1024 or unit == 'GB':
+            return f"{size:.0f} {unit}" if unit == 'B' else f"{size:.1f} {unit}"
+        size /= 1024
+
+def print_inventory(inventory, output_format='table'):
+    """Print a folder inventory as a table, CSV or JSON."""
+    if output_format == 'json':
+        print(json.dumps(inventory, indent=2))
+        return
+
+    if output_format == 'csv':
+        writer = csv.DictWriter(sys.stdout, fieldnames=['folder', 'messages', 'unseen', 'size_bytes', 'error'])
+        writer.writeheader()
+        writer.writerows(inventory)
+        return
+
+    print("Your IMAP folders and message counts:")
+    print("-" * 75)
+    print(f"{'Folder':<30}   {'Messages':>10} {'Unseen':>10} {'Size':>12}")
+    print("-" * 75)
+    total_messages = 0
+    total_size = 0
+    for entry in inventory:
+        if entry['error']:
+            print(f"{entry['folder']:<30} : {entry['error']}")
+            continue
+        total_messages += entry['messages'] or 0
+        total_size += entry['size_bytes'] or 0
+        unseen = entry['unseen'] if entry['unseen'] is not None else '-'
+        print(f"{entry['folder']:<30} : {entry['messages']:>10} {unseen:>10} {format_size(entry['size_bytes']):>12}")
+    print("-" * 75)
+    has_sizes = any(entry['size_bytes'] is not None for entry in inventory)
+    print(f"{'Total':<30} : {total_messages:>10} {'':>10} {format_size(total_size if has_sizes else None):>12}")
     print("Done.")
 
-def get_emails_from_folder(folder_name, limit=5, show_uid=False, username='user@example.com', password='ChangeMe', server='mx.example.com'):
+def list_folders(username='user@example.com', password='ChangeMe', server='mx.example.com', output_format='table'):
+    """List all IMAP folders with message, unseen and size counts."""
+    imap = connect_to_imap(username, password, server)
+    try:
+        inventory = folder_inventory(imap)
+    finally:
+        imap.logout()
+    print_inventory(inventory, output_format)
+
+SUMMARY_HEADER_FIELDS = 'FROM SUBJECT DATE X-SPAMD-RESULT X-SPAM-STATUS'
+
+def compress_uids(uids):
+    """Render UIDs as a compact IMAP sequence set, e.g. [1, 2, 3, 7] -> '1:3,7'."""
+    ranges = []
+    for uid in sorted(set(int(u) for u in uids)):
+        if ranges and uid == ranges[-1][1] + 1:
+            ranges[-1][1] = uid
+        else:
+            ranges.append([uid, uid])
+    return ','.join(str(a) if a == b else f"{a}:{b}" for a, b in ranges)
+
+def expand_uid_set(value):
+    """Expand an IMAP sequence set such as '4:7,9' into a list of ints."""
+    uids = []
+    for part in value.split(','):
+        if ':' in part:
+            a, b = part.split(':', 1)
+            a, b = int(a), int(b)
+            uids.extend(range(min(a, b), max(a, b) + 1))
+        elif part:
+            uids.append(int(part))
+    return uids
+
+def select_folder(imap, folder_name):
+    """EXAMINE a folder (read-only) and return its EXISTS count, or None if it cannot be opened."""
+    status, data = imap.select(quote_mailbox(folder_name), readonly=True)
+    if status != 'OK':
+        return None
+    try:
+        return int(data[0])
+    except (TypeError, ValueError, IndexError):
+        return 0
+
+def newest_uids(imap, exists, limit):
+    """Return the UIDs of the newest 'limit' messages in the selected folder.
+
+    The newest messages are the highest sequence numbers, so only that
+    range is searched; the folder is never enumerated.  ESEARCH (RFC 4731)
+    is used when available so the reply is a compact range rather than
+    one number per message.
+    """
+    if not exists or limit <= 0:
+        return []
+    seq_range = f"{max(1, exists - limit + 1)}:{exists}"
+
+    if 'ESEARCH' in imap.capabilities:
+        status, data = imap.uid('SEARCH', 'RETURN', '(ALL)', seq_range)
+        if status == 'OK':
+            _, esearch = imap.response('ESEARCH')
+            for line in esearch or []:
+                if isinstance(line, bytes):
+                    match = re.search(r'\bALL\s+([\d:,]+)', line.decode(errors='ignore'), re.I)
+                    if match:
+                        return expand_uid_set(match.group(1))
+            return []
+
+    status, data = imap.uid('SEARCH', None, seq_range)
+    if status != 'OK' or not data or not data[0]:
+        return []
+    return [int(uid) for uid in data[0].split()]
+
+def fetch_header_fields(imap, uids, fields=SUMMARY_HEADER_FIELDS):
+    """Fetch selected header fields for many UIDs with one UID FETCH; returns {uid: raw header bytes}.
+
+    'uids' is a list of UIDs or a ready-made UID set string such as '120:*'.
+    """
+    if not uids:
+        return {}
+    uid_set = uids if isinstance(uids, str) else compress_uids(uids)
+    status, data = imap.uid('FETCH', uid_set, f'(UID BODY.PEEK[HEADER.FIELDS ({fields})])')
+    if status != 'OK':
+        return {}
+
+    headers = {}
+    items = list(data or [])
+    for i, item in enumerate(items):
+        if not isinstance(item, tuple):
+            continue
+        match = re.search(rb'\bUID (\d+)', item[0])
+        if not match and i + 1 < len(items) and isinstance(items[i + 1], bytes):
+            # Some servers put UID after the literal: "... {n} <data> UID 123)"
+            match = re.search(rb'\bUID (\d+)', items[i + 1])
+        if match:
+            headers[int(match.group(1))] = item[1]
+    return headers
+
+def parse_summary_headers(header_data):
+    """Parse a header block into a dict of decoded From, Subject, Date and spam headers."""
+    message = email.message_from_bytes(header_data)
+    summary = {}
+    for key, name in (('from', 'From'), ('subject', 'Subject'), ('date', 'Date'),
+                      ('spamd_result', 'X-Spamd-Result'), ('spam_status', 'X-Spam-Status')):
+        value = message.get(name, '')
+        # Unfold continuation lines into a single line
+        value = ' '.join(str(value).split())
+        summary[key] = decode_mime_words(value) if key in ('from', 'subject') and value else value
+    return summary
+
+def spam_score(summary):
+    """Extract '[score / threshold]' from X-Spamd-Result, falling back to X-Spam-Status."""
+    spamd_result = summary.get('spamd_result', '')
+    if spamd_result:
+        match = re.search(r'\[([^\]]+)\]', spamd_result)
+        return match.group(1) if match else spamd_result
+    spam_status = summary.get('spam_status', '')
+    match = re.search(r'score=(-?[\d.]+)', spam_status)
+    return match.group(1) if match else spam_status
+
+def get_emails_from_folder(folder_name, limit=5, show_uid=False, username='user@example.com', password='ChangeMe', server='mx.example.com', cache=None):
     """Get the latest emails from specified folder and display in table format."""
     imap = connect_to_imap(username, password, server)
+    refresh_capabilities(imap)
 
     try:
-        # Select the folder
-        result = imap.select(f'"{folder_name}"')
-        if result[0] != 'OK':
+        if cache is not None:
+            synced = sync_folder_cache(imap, cache, f"{username}@{server}", folder_name)
+            exists = synced[1] if synced else None
+        else:
+            exists = select_folder(imap, folder_name)
+        if exists is None:
             print(f"Cannot select folder: {folder_name}")
-            imap.logout()
+            return
+        if exists == 0:
+            print(f"No messages found in folder: {folder_name}")
             return
 
-        # Try to use SORT command to get messages in reverse date order (newest first)
-        # If SORT is not supported by the server, fall back to basic approach
-        try:
-            status, msg_ids = imap.sort('REVERSE DATE', 'UTF-8', 'ALL')
-            if not msg_ids or status != 'OK':
-                # If sort fails, fall back to basic search
-                raise Exception("SORT not supported or failed")
-            # Ensure msg_ids is properly formatted
-            if msg_ids and msg_ids[0]:
-                if isinstance(msg_ids[0], bytes):
-                    msg_ids = msg_ids[0].decode().split()
-                elif isinstance(msg_ids[0], str):
-                    msg_ids = msg_ids[0].split()
-                else:
-                    msg_ids = [str(x) for x in msg_ids[0]]
-            else:
-                # If sort returns empty, fall back to basic search
-                raise Exception("SORT returned empty result")
-        except:
-            # Fallback: get all messages and use UID search to get most recent emails
-            # First, get all message UIDs in ascending order
-            status, messages = imap.search(None, 'ALL')
-            if not messages[0]:
-                print(f"No messages found in folder: {folder_name}")
-                imap.logout()
-                return
-            msg_ids = messages[0].split()
-            # Convert to integers, sort in reverse order to get highest numbers first (most recent)
-            msg_ids = [x.decode() if isinstance(x, bytes) else x for x in msg_ids]  # Ensure strings
-            msg_ids = sorted(msg_ids, key=lambda x: int(x), reverse=True)
-
-        # Take only the first 'limit' messages (which are the newest)
-        msg_ids = msg_ids[:limit] if len(msg_ids) >= limit else msg_ids
+        # Newest first by arrival (UID order)
+        if cache is not None:
+            summaries = list(cache.summaries(f"{username}@{server}", folder_name, synced[0], newest=limit))
+        else:
+            uids = sorted(newest_uids(imap, exists, limit), reverse=True)[:limit]
+            headers = fetch_header_fields(imap, uids)
+            summaries = [(uid, parse_summary_headers(headers[uid])) for uid in uids if uid in headers]
+        uids = [uid for uid, _ in summaries]
 
         # Print table header
-        print(f"\nLatest {len(msg_ids)} emails from '{folder_name}':")
+        print(f"\nLatest {len(uids)} emails from '{folder_name}':")
         if show_uid:
             print(f"{'UID':<10} {'From':<50} {'Subject':<50} {'X-Spamd-Result':<30}")
             print("-" * 140)
@@ -125,82 +490,22 @@ def get_emails_from_folder(folder_name, limit=5, show_uid=False, username='user@
             print(f"{'From':<60} {'Subject':<50} {'X-Spamd-Result':<30}")
             print("-" * 140)
 
-        # Fetch email headers for each message
-        for msg_id in msg_ids:
-            # Ensure msg_id is a string for the fetch command
-            msg_str = str(msg_id).encode() if isinstance(msg_id, str) else msg_id
-            status, msg_data = imap.fetch(msg_str, '(RFC822.HEADER)')
-            if status == 'OK':
-                header_data = msg_data[0][1]
-
-                # Parse header data
-                from_header = ""
-                subject_header = ""
-                spamd_result = ""
-
-                lines = header_data.decode('utf-8', errors='ignore').split('\r\n')
-
-                # Better approach: parse headers by tracking which header we're currently reading
-                current_header = None
-                header_content = []
-
-                for line in lines:
-                    # Check if this line is a new header field
-                    if ':' in line and (line[0] != ' ' and line[0] != '\t'):
-                        # Save the previous header if we have one
-                        if current_header and header_content:
-                            header_value = ' '.join(header_content).strip()
-                            if current_header.lower() == 'from':
-                                from_header = header_value
-                            elif current_header.lower() == 'subject':
-                                subject_header = header_value
-                            elif current_header.lower() == 'x-spamd-result':
-                                spamd_result = header_value
-
-                        # Start a new header
-                        colon_pos = line.find(':')
-                        current_header = line[:colon_pos].lower()
-                        header_content = [line[colon_pos+1:].strip()]
-                    else:
-                        # This is a continuation of the current header (indented)
-                        if current_header:
-                            header_content.append(line.strip())
-
-                # Don't forget the last header
-                if current_header and header_content:
-                    header_value = ' '.join(header_content).strip()
-                    if current_header.lower() == 'from':
-                        from_header = header_value
-                    elif current_header.lower() == 'subject':
-                        subject_header = header_value
-                    elif current_header.lower() == 'x-spamd-result':
-                        spamd_result = header_value
-
-                # Decode headers if needed
-                if from_header:
-                    from_header = decode_mime_words(from_header)
-                if subject_header:
-                    subject_header = decode_mime_words(subject_header)
-
-                # Extract the score part from X-Spamd-Result: default: False [9.10 / 1004.00];
-                if spamd_result:
-                    match = re.search(r'\[([^\]]+)\]', spamd_result)
-                    if match:
-                        spamd_result = match.group(1)  # Extract content between brackets
-                    else:
-                        spamd_result = spamd_result  # Use the full value if no brackets found
-
-                # Truncate headers to specified width
-                if show_uid:
-                    from_display = (from_header[:47] + '...') if from_header and len(from_header) > 50 else (from_header or '')
-                    subject_display = (subject_header[:47] + '...') if subject_header and len(subject_header) > 50 else (subject_header or '')
-                    spamd_display = (spamd_result[:27] + '...') if spamd_result and len(spamd_result) > 30 else (spamd_result or '')
-                    print(f"{msg_id:<10} {from_display:<50} {subject_display:<50} {spamd_display:<30}")
-                else:
-                    from_display = (from_header[:57] + '...') if from_header and len(from_header) > 60 else (from_header or '')
-                    subject_display = (subject_header[:47] + '...') if subject_header and len(subject_header) > 50 else (subject_header or '')
-                    spamd_display = (spamd_result[:27] + '...') if spamd_result and len(spamd_result) > 30 else (spamd_result or '')
-                    print(f"{from_display:<60} {subject_display:<50} {spamd_display:<30}")
+        for uid, summary in summaries:
+            from_header = summary['from']
+            subject_header = summary['subject']
+            spamd_result = spam_score(summary)
+
+            # Truncate headers to specified width
+            if show_uid:
+                from_display = (from_header[:47] + '...') if from_header and len(from_header) > 50 else (from_header or '')
+                subject_display = (subject_header[:47] + '...') if subject_header and len(subject_header) > 50 else (subject_header or '')
+                spamd_display = (spamd_result[:27] + '...') if spamd_result and len(spamd_result) > 30 else (spamd_result or '')
+                print(f"{uid:<10} {from_display:<50} {subject_display:<50} {spamd_display:<30}")
+            else:
+                from_display = (from_header[:57] + '...') if from_header and len(from_header) > 60 else (from_header or '')
+                subject_display = (subject_header[:47] + '...') if subject_header and len(subject_header) > 50 else (subject_header or '')
+                spamd_display = (spamd_result[:27] + '...') if spamd_result and len(spamd_result) > 30 else (spamd_result or '')
+                print(f"{from_display:<60} {subject_display:<50} {spamd_display:<30}")
 
         print("-" * 140)
 
@@ -208,9 +513,601 @@ def get_emails_from_folder(folder_name, limit=5, show_uid=False, username='user@
         print(f"Error accessing folder {folder_name}: {str(e)}")
 
     finally:
-        imap.close()
+        if imap.state == 'SELECTED':
+            imap.close()
         imap.logout()
 
+DEFAULT_CACHE_FILE = os.path.expanduser('~/.cache/discover-folders/headers.sqlite3')
+
+CACHE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS folders (
+    account TEXT NOT NULL,
+    folder TEXT NOT NULL,
+    uidvalidity INTEGER NOT NULL,
+    uidnext INTEGER,
+    highestmodseq INTEGER,
+    message_count INTEGER,
+    PRIMARY KEY (account, folder)
+);
+CREATE TABLE IF NOT EXISTS messages (
+    account TEXT NOT NULL,
+    folder TEXT NOT NULL,
+    uidvalidity INTEGER NOT NULL,
+    uid INTEGER NOT NULL,
+    from_header TEXT,
+    subject TEXT,
+    date TEXT,
+    spamd_result TEXT,
+    spam_status TEXT,
+    PRIMARY KEY (account, folder, uidvalidity, uid)
+);
+"""
+
+class HeaderCache:
+    """SQLite cache of parsed summary headers keyed by account, folder, UIDVALIDITY and UID."""
+
+    def __init__(self, path=DEFAULT_CACHE_FILE):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.db = sqlite3.connect(path)
+        self.db.executescript(CACHE_SCHEMA)
+
+    def folder_state(self, account, folder):
+        row = self.db.execute(
+            "SELECT uidvalidity, uidnext, highestmodseq, message_count FROM folders WHERE account = ? AND folder = ?",
+            (account, folder)).fetchone()
+        if not row:
+            return None
+        return {'uidvalidity': row[0], 'uidnext': row[1], 'highestmodseq': row[2], 'message_count': row[3]}
+
+    def set_folder_state(self, account, folder, uidvalidity, uidnext, highestmodseq):
+        count = self.db.execute(
+            "SELECT COUNT(*) FROM messages WHERE account = ? AND folder = ? AND uidvalidity = ?",
+            (account, folder, uidvalidity)).fetchone()[0]
+        self.db.execute(
+            "INSERT OR REPLACE INTO folders (account, folder, uidvalidity, uidnext, highestmodseq, message_count) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (account, folder, uidvalidity, uidnext, highestmodseq, count))
+        self.db.commit()
+        return count
+
+    def reset_folder(self, account, folder):
+        """Drop everything cached for a folder (UIDVALIDITY changed)."""
+        self.db.execute("DELETE FROM messages WHERE account = ? AND folder = ?", (account, folder))
+        self.db.execute("DELETE FROM folders WHERE account = ? AND folder = ?", (account, folder))
+        self.db.commit()
+
+    def max_uid(self, account, folder, uidvalidity):
+        row = self.db.execute(
+            "SELECT MAX(uid) FROM messages WHERE account = ? AND folder = ? AND uidvalidity = ?",
+            (account, folder, uidvalidity)).fetchone()
+        return row[0] or 0
+
+    def cached_uids(self, account, folder, uidvalidity):
+        rows = self.db.execute(
+            "SELECT uid FROM messages WHERE account = ? AND folder = ? AND uidvalidity = ?",
+            (account, folder, uidvalidity))
+        return {row[0] for row in rows}
+
+    def add(self, account, folder, uidvalidity, headers):
+        """Store {uid: raw header bytes} as parsed summary rows."""
+        rows = []
+        for uid, header_data in headers.items():
+            summary = parse_summary_headers(header_data)
+            rows.append((account, folder, uidvalidity, uid, summary['from'], summary['subject'],
+                         summary['date'], summary['spamd_result'], summary['spam_status']))
+        self.db.executemany("INSERT OR REPLACE INTO messages VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        self.db.commit()
+
+    def remove(self, account, folder, uidvalidity, uids):
+        self.db.executemany(
+            "DELETE FROM messages WHERE account = ? AND folder = ? AND uidvalidity = ? AND uid = ?",
+            [(account, folder, uidvalidity, uid) for uid in uids])
+        self.db.commit()
+
+    def summaries(self, account, folder, uidvalidity, newest=None):
+        """Yield (uid, summary dict) from the cache, newest first; all rows when newest is None."""
+        sql = ("SELECT uid, from_header, subject, date, spamd_result, spam_status FROM messages "
+               "WHERE account = ? AND folder = ? AND uidvalidity = ? ORDER BY uid DESC")
+        params = [account, folder, uidvalidity]
+        if newest is not None:
+            sql += " LIMIT ?"
+            params.append(newest)
+        for row in self.db.execute(sql, params):
+            yield row[0], {'from': row[1] or '', 'subject': row[2] or '', 'date': row[3] or '',
+                           'spamd_result': row[4] or '', 'spam_status': row[5] or ''}
+
+    def close(self):
+        self.db.close()
+
+def response_int(imap, code):
+    """Pop an untagged response code such as UIDVALIDITY and return it as an int (or None)."""
+    _, data = imap.response(code)
+    try:
+        return int(data[-1])
+    except (TypeError, ValueError, IndexError):
+        return None
+
+def sync_folder_cache(imap, cache, account, folder_name, batch_size=1000):
+    """Bring the cache for one folder up to date and return (uidvalidity, exists), or None.
+
+    With CONDSTORE an unchanged HIGHESTMODSEQ means nothing happened in the
+    folder, so no further commands are sent.  Otherwise only UIDs above the
+    cached maximum are fetched; a full UID SEARCH is issued only when the
+    message count shows that something was expunged.
+    """
+    condstore = 'CONDSTORE' in imap.capabilities
+    if condstore and 'ENABLE' in imap.capabilities:
+        try:
+            imap.enable('CONDSTORE')
+        except imaplib.IMAP4.error:
+            condstore = False
+
+    exists = select_folder(imap, folder_name)
+    if exists is None:
+        return None
+    uidvalidity = response_int(imap, 'UIDVALIDITY') or 0
+    uidnext = response_int(imap, 'UIDNEXT')
+    highestmodseq = response_int(imap, 'HIGHESTMODSEQ') if condstore else None
+
+    state = cache.folder_state(account, folder_name)
+    if state and state['uidvalidity'] != uidvalidity:
+        print(f"  cache: UIDVALIDITY changed for '{folder_name}', rebuilding", file=sys.stderr)
+        cache.reset_folder(account, folder_name)
+        state = None
+
+    if state and state['message_count'] == exists and (
+            (highestmodseq is not None and state['highestmodseq'] == highestmodseq) or
+            (highestmodseq is None and uidnext is not None and state['uidnext'] == uidnext)):
+        return uidvalidity, exists
+
+    # Fetch headers for UIDs we have not seen yet
+    last_uid = cache.max_uid(account, folder_name, uidvalidity)
+    fetched = 0
+    status, data = imap.uid('SEARCH', None, f'UID {last_uid + 1}:*')
+    new_uids = [int(uid) for uid in data[0].split()] if status == 'OK' and data and data[0] else []
+    # "n:*" always matches the highest UID, even when it is below n
+    new_uids = [uid for uid in new_uids if uid > last_uid]
+    for start in range(0, len(new_uids), batch_size):
+        headers = fetch_header_fields(imap, new_uids[start:start + batch_size])
+        cache.add(account, folder_name, uidvalidity, headers)
+        fetched += len(headers)
+        print(f"  cache: fetched {fetched}/{len(new_uids)} new headers", end='\r', file=sys.stderr)
+    if fetched:
+        print(file=sys.stderr)
+
+    # Something was expunged if the cache now holds more messages than the folder
+    cached = cache.set_folder_state(account, folder_name, uidvalidity, uidnext, highestmodseq)
+    if cached != exists:
+        status, data = imap.uid('SEARCH', None, 'ALL')
+        live = {int(uid) for uid in data[0].split()} if status == 'OK' and data and data[0] else set()
+        gone = cache.cached_uids(account, folder_name, uidvalidity) - live
+        cache.remove(account, folder_name, uidvalidity, gone)
+        cache.set_folder_state(account, folder_name, uidvalidity, uidnext, highestmodseq)
+        if gone:
+            print(f"  cache: dropped {len(gone)} expunged messages", file=sys.stderr)
+
+    return uidvalidity, exists
+
+REPORT_HEADER_FIELDS = 'FROM X-SPAMD-RESULT X-SPAM-STATUS'
+SPAMD_SYMBOL_RE = re.compile(r'([A-Z][A-Z0-9_]*)\((-?[\d.]+)\)')
+
+def iter_folder_headers(imap, exists, fields=REPORT_HEADER_FIELDS, batch_size=1000):
+    """Yield (uid, raw header bytes) for every message in the selected folder.
+
+    Messages are fetched by sequence-number range, batch_size at a time, so
+    only one batch is ever held in memory and the UID list is never built.
+    """
+    for start in range(1, exists + 1, batch_size):
+        end = min(start + batch_size - 1, exists)
+        status, data = imap.fetch(f"{start}:{end}", f'(UID BODY.PEEK[HEADER.FIELDS ({fields})])')
+        if status != 'OK':
+            continue
+        items = list(data or [])
+        for i, item in enumerate(items):
+            if not isinstance(item, tuple):
+                continue
+            match = re.search(rb'\bUID (\d+)', item[0])
+            if not match and i + 1 < len(items) and isinstance(items[i + 1], bytes):
+                match = re.search(rb'\bUID (\d+)', items[i + 1])
+            yield (int(match.group(1)) if match else None), item[1]
+
+def parse_spamd_result(spamd_result):
+    """Split X-Spamd-Result into (is_spam, score, [(symbol, score), ...])."""
+    is_spam = None
+    score = None
+    head = re.match(r'\s*[\w-]+:\s*(True|False)\s*\[\s*(-?[\d.]+)\s*/', spamd_result, re.I)
+    if head:
+        is_spam = head.group(1).lower() == 'true'
+        score = float(head.group(2))
+    # Only look after the "[score / threshold]" block for symbols
+    body = spamd_result[head.end():] if head else spamd_result
+    symbols = [(name, float(value)) for name, value in SPAMD_SYMBOL_RE.findall(body)]
+    return is_spam, score, symbols
+
+class TopCounter:
+    """Approximate top-k counter (Space-Saving) holding at most 'capacity' keys.
+
+    The smallest counter is found with a lazy-deletion min-heap of
+    (count, key) entries: increments push a fresh entry and outdated ones
+    are skipped when popped, so an eviction costs O(log capacity) instead
+    of a scan over every counter.
+    """
+
+    def __init__(self, capacity=1000):
+        self.capacity = capacity
+        self.counts = {}
+        self.heap = []
+
+    def add(self, key):
+        if key in self.counts:
+            self.counts[key] += 1
+        elif len(self.counts) < self.capacity:
+            self.counts[key] = 1
+        else:
+            # Evict the smallest counter and let the newcomer inherit its count
+            while True:
+                count, victim = heapq.heappop(self.heap)
+                if self.counts.get(victim) == count:
+                    break
+            self.counts[key] = self.counts.pop(victim) + 1
+        heapq.heappush(self.heap, (self.counts[key], key))
+        if len(self.heap) > 4 * max(self.capacity, 16):
+            # Drop outdated entries so the heap stays proportional to capacity
+            self.heap = [(count, k) for k, count in self.counts.items()]
+            heapq.heapify(self.heap)
+
+    def most_common(self, n):
+        return sorted(self.counts.items(), key=lambda kv: kv[1], reverse=True)[:n]
+
+class SpamReport:
+    """Streaming aggregate of spam headers: symbol hits, score histogram, sender domains."""
+
+    def __init__(self, bucket_width=1.0, domain_capacity=1000):
+        self.bucket_width = bucket_width
+        self.messages = 0
+        self.with_result = 0
+        self.flagged_spam = 0
+        self.symbol_hits = {}
+        self.symbol_score_sum = {}
+        self.histogram = {}
+        self.domains = TopCounter(domain_capacity)
+
+    def add(self, summary):
+        self.messages += 1
+
+        from_addr = email.utils.parseaddr(summary.get('from', ''))[1]
+        domain = from_addr.rsplit('@', 1)[1].lower() if '@' in from_addr else '(none)'
+        self.domains.add(domain)
+
+        score = None
+        if summary.get('spamd_result'):
+            is_spam, score, symbols = parse_spamd_result(summary['spamd_result'])
+            self.with_result += 1
+            if is_spam:
+                self.flagged_spam += 1
+            for name, value in symbols:
+                self.symbol_hits[name] = self.symbol_hits.get(name, 0) + 1
+                self.symbol_score_sum[name] = self.symbol_score_sum.get(name, 0.0) + value
+        if score is None:
+            match = re.search(r'score=(-?[\d.]+)', summary.get('spam_status', ''))
+            if match:
+                score = float(match.group(1))
+        if score is not None:
+            bucket = int(score // self.bucket_width)
+            self.histogram[bucket] = self.histogram.get(bucket, 0) + 1
+
+    def to_dict(self, top=20):
+        symbols = sorted(self.symbol_hits.items(), key=lambda kv: kv[1], reverse=True)[:top]
+        return {
+            'messages': self.messages,
+            'with_spamd_result': self.with_result,
+            'flagged_spam': self.flagged_spam,
+            'symbols': [
+                {'symbol': name, 'hits': hits,
+                 'percent': round(100.0 * hits / self.with_result, 1) if self.with_result else 0.0,
+                 'avg_score': round(self.symbol_score_sum[name] / hits, 2)}
+                for name, hits in symbols
+            ],
+            'score_histogram': [
+                {'from': bucket * self.bucket_width, 'to': (bucket + 1) * self.bucket_width, 'count': count}
+                for bucket, count in sorted(self.histogram.items())
+            ],
+            'sender_domains': [
+                {'domain': domain, 'count': count} for domain, count in self.domains.most_common(top)
+            ],
+        }
+
+def print_report(folder_name, report, output_format='table'):
+    """Print a SpamReport dict as a text report, CSV rows or JSON."""
+    if output_format == 'json':
+        print(json.dumps(dict(folder=folder_name, **report), indent=2))
+        return
+
+    if output_format == 'csv':
+        writer = csv.writer(sys.stdout)
+        writer.writerow(['section', 'key', 'count', 'value'])
+        for row in report['symbols']:
+            writer.writerow(['symbol', row['symbol'], row['hits'], row['avg_score']])
+        for row in report['score_histogram']:
+            writer.writerow(['score', f"{row['from']:g}..{row['to']:g}", row['count'], ''])
+        for row in report['sender_domains']:
+            writer.writerow(['domain', row['domain'], row['count'], ''])
+        return
+
+    print(f"\nSpam header report for '{folder_name}':")
+    print("=" * 70)
+    print(f"Messages scanned      : {report['messages']}")
+    print(f"With X-Spamd-Result   : {report['with_spamd_result']}")
+    print(f"Flagged spam (True)   : {report['flagged_spam']}")
+
+    print(f"\n{'Symbol':<40} {'Hits':>8} {'%':>7} {'Avg score':>10}")
+    print("-" * 70)
+    for row in report['symbols']:
+        print(f"{row['symbol']:<40} {row['hits']:>8} {row['percent']:>6.1f}% {row['avg_score']:>10.2f}")
+
+    print(f"\n{'Score':<20} {'Count':>8}")
+    print("-" * 70)
+    peak = max([row['count'] for row in report['score_histogram']] or [1])
+    for row in report['score_histogram']:
+        bar = '#' * max(1, int(40 * row['count'] / peak))
+        print(f"{row['from']:>7g} .. {row['to']:<7g} {row['count']:>8} {bar}")
+
+    print(f"\n{'Sender domain':<50} {'Count':>8}")
+    print("-" * 70)
+    for row in report['sender_domains']:
+        print(f"{row['domain']:<50} {row['count']:>8}")
+    print("=" * 70)
+
+def report_folder(folder_name, top=20, batch_size=1000, output_format='table', username='user@example.com', password='ChangeMe', server='mx.example.com', cache=None):
+    """Scan every message header in a folder and print aggregate spam statistics."""
+    imap = connect_to_imap(username, password, server)
+    refresh_capabilities(imap)
+
+    try:
+        if cache is not None:
+            synced = sync_folder_cache(imap, cache, f"{username}@{server}", folder_name, batch_size)
+            exists = synced[1] if synced else None
+        else:
+            exists = select_folder(imap, folder_name)
+        if exists is None:
+            print(f"Cannot select folder: {folder_name}")
+            return
+
+        if cache is not None:
+            summaries = (summary for uid, summary in cache.summaries(f"{username}@{server}", folder_name, synced[0]))
+        else:
+            summaries = (parse_summary_headers(header_data)
+                         for uid, header_data in iter_folder_headers(imap, exists, batch_size=batch_size))
+
+        report = SpamReport()
+        for summary in summaries:
+            report.add(summary)
+            if report.messages % batch_size == 0:
+                print(f"  scanned {report.messages}/{exists}", end='\r', file=sys.stderr)
+        if exists:
+            print(f"  scanned {report.messages}/{exists}", file=sys.stderr)
+
+        print_report(folder_name, report.to_dict(top), output_format)
+
+    except Exception as e:
+        print(f"Error accessing folder {folder_name}: {str(e)}")
+
+    finally:
+        if imap.state == 'SELECTED':
+            imap.close()
+        imap.logout()
+
+class FolderFollower:
+    """One IMAP connection watching one folder for new mail, for --follow."""
+
+    def __init__(self, folder_name, username, password, server):
+        self.folder_name = folder_name
+        self.username = username
+        self.password = password
+        self.server = server
+        self.imap = None
+        self.idle_tag = None
+        self.idle_started = 0.0
+        self.last_poll = 0.0
+        self.last_uid = 0
+        self.uidvalidity = None
+        self.watching = False
+        self.retry_at = 0.0
+        self.retry_delay = 5
+
+    def open(self):
+        """Connect, EXAMINE the folder and start watching; return [(uid, summary)] missed meanwhile.
+
+        The first open only remembers the current highest UID.  On a reconnect
+        last_uid is kept, so mail delivered while the connection was down is
+        fetched before IDLE resumes.  A changed UIDVALIDITY makes the old UIDs
+        meaningless, and watching starts over from the current highest UID.
+        """
+        self.imap = connect_to_imap(self.username, self.password, self.server)
+        refresh_capabilities(self.imap)
+        exists = select_folder(self.imap, self.folder_name)
+        if exists is None:
+            raise imaplib.IMAP4.error(f"cannot select folder {self.folder_name}")
+        uidvalidity = response_int(self.imap, 'UIDVALIDITY')
+        uidnext = response_int(self.imap, 'UIDNEXT')
+        missed = []
+        if not self.watching or uidvalidity != self.uidvalidity:
+            self.uidvalidity = uidvalidity
+            if uidnext:
+                self.last_uid = uidnext - 1
+            else:
+                self.last_uid = max(newest_uids(self.imap, exists, 1) or [0])
+        elif exists and (uidnext is None or uidnext > self.last_uid + 1):
+            missed = self.fetch_new()
+        self.watching = True
+        self.retry_delay = 5
+        self.last_poll = time.monotonic()
+        if self.supports_idle():
+            self.start_idle()
+        return missed
+
+    def supports_idle(self):
+        return self.imap is not None and 'IDLE' in self.imap.capabilities
+
+    def socket(self):
+        return self.imap.socket() if self.imap is not None else None
+
+    def start_idle(self):
+        self.idle_tag = self.imap._new_tag()
+        self.imap.send(self.idle_tag + b' IDLE\r\n')
+        line = self.imap.readline()
+        if not line.startswith(b'+'):
+            self.idle_tag = None
+            raise imaplib.IMAP4.error(f"IDLE rejected: {line.decode(errors='replace').strip()}")
+        self.idle_started = time.monotonic()
+
+    def stop_idle(self):
+        """Send DONE and drain responses up to the tagged completion."""
+        if self.idle_tag is None:
+            return
+        self.imap.send(b'DONE\r\n')
+        while True:
+            line = self.imap.readline()
+            if not line:
+                raise imaplib.IMAP4.abort("connection closed while ending IDLE")
+            if line.startswith(self.idle_tag):
+                break
+        self.idle_tag = None
+
+    def read_event(self):
+        """Read one line received during IDLE; True if it announces new mail."""
+        line = self.imap.readline()
+        if not line:
+            raise imaplib.IMAP4.abort("connection closed during IDLE")
+        return line.startswith(b'*') and (b'EXISTS' in line or b'RECENT' in line)
+
+    def has_buffered_data(self):
+        """True if IDLE data is already waiting where select() cannot see it.
+
+        imaplib reads through a buffered file object, so the line after
+        "+ idling" (or after the last event) may already sit in the Python
+        buffer, and TLS may hold decrypted bytes too. Peek without blocking.
+        """
+        sock = self.socket()
+        if getattr(sock, 'pending', lambda: 0)():
+            return True
+        timeout = sock.gettimeout()
+        sock.setblocking(False)
+        try:
+            return bool(self.imap.file.peek(1))
+        except (BlockingIOError, ssl.SSLWantReadError):
+            return False
+        finally:
+            sock.settimeout(timeout)
+
+    def fetch_new(self):
+        """Return [(uid, summary)] for messages above last_uid, in arrival order."""
+        headers = fetch_header_fields(self.imap, f"{self.last_uid + 1}:*")
+        # "n:*" always matches the highest UID, even when it is below n
+        new = sorted(uid for uid in headers if uid > self.last_uid)
+        if new:
+            self.last_uid = new[-1]
+        return [(uid, parse_summary_headers(headers[uid])) for uid in new]
+
+    def close(self):
+        if self.imap is None:
+            return
+        try:
+            self.stop_idle()
+            self.imap.logout()
+        except Exception:
+            pass
+        self.imap = None
+        self.idle_tag = None
+
+def print_arrival(folder_name, uid, summary):
+    """Print one newly arrived message as a single line."""
+    from_header = summary['from'] or ''
+    subject = summary['subject'] or ''
+    score = spam_score(summary) or '-'
+    from_display = (from_header[:37] + '...') if len(from_header) > 40 else from_header
+    subject_display = (subject[:47] + '...') if len(subject) > 50 else subject
+    score_display = (score[:17] + '...') if len(score) > 20 else score
+    print(f"{time.strftime('%H:%M:%S')} {folder_name[:15]:<15} {uid:>8} {score_display:<20} "
+          f"{from_display:<40} {subject_display}", flush=True)
+
+def follow_folders(folder_names, username='user@example.com', password='ChangeMe', server='mx.example.com', idle_timeout=1500, poll_interval=30):
+    """Watch several folders at once and print each new message as it arrives.
+
+    Each folder gets its own connection holding IMAP IDLE; a single select()
+    loop multiplexes all of them, so an arrival is printed as soon as the
+    server announces it. Servers without IDLE are polled with NOOP every
+    poll_interval seconds. IDLE is re-issued before idle_timeout (servers
+    drop it after 30 minutes) and dropped connections are retried with
+    exponential backoff.
+    """
+    followers = [FolderFollower(name, username, password, server) for name in folder_names]
+    print(f"Following {', '.join(repr(name) for name in folder_names)} (Ctrl-C to stop)")
+    print(f"{'Time':<8} {'Folder':<15} {'UID':>8} {'X-Spamd-Result':<20} {'From':<40} Subject")
+    print("-" * 140, flush=True)
+
+    def fail(follower, error):
+        print(f"⚠ {follower.folder_name}: {error}; retrying in {follower.retry_delay}s", file=sys.stderr)
+        follower.close()
+        follower.retry_at = time.monotonic() + follower.retry_delay
+        follower.retry_delay = min(follower.retry_delay * 2, 300)
+
+    def report_new(follower):
+        follower.stop_idle()
+        for uid, summary in follower.fetch_new():
+            print_arrival(follower.folder_name, uid, summary)
+        follower.last_poll = time.monotonic()
+        if follower.supports_idle():
+            follower.start_idle()
+
+    try:
+        while True:
+            now = time.monotonic()
+            for follower in followers:
+                if follower.imap is None and now >= follower.retry_at:
+                    try:
+                        for uid, summary in follower.open():
+                            print_arrival(follower.folder_name, uid, summary)
+                    except Exception as e:
+                        fail(follower, e)
+
+            live = [f for f in followers if f.imap is not None]
+            ready = [f for f in live if f.idle_tag is not None and f.has_buffered_data()]
+            if not ready:
+                sockets = {f.socket(): f for f in live if f.idle_tag is not None}
+                if sockets:
+                    readable, _, _ = select.select(list(sockets), [], [], 1.0)
+                    ready = [sockets[sock] for sock in readable]
+                else:
+                    time.sleep(1.0)
+
+            for follower in ready:
+                try:
+                    if follower.read_event():
+                        report_new(follower)
+                except Exception as e:
+                    fail(follower, e)
+
+            now = time.monotonic()
+            for follower in live:
+                if follower.imap is None:
+                    continue
+                try:
+                    if follower.idle_tag is not None and now - follower.idle_started >= idle_timeout:
+                        report_new(follower)
+                    elif follower.idle_tag is None and now - follower.last_poll >= poll_interval:
+                        follower.imap.noop()
+                        report_new(follower)
+                except Exception as e:
+                    fail(follower, e)
+    except KeyboardInterrupt:
+        print("\nStopped.")
+    finally:
+        for follower in followers:
+            follower.close()
+
 def decode_mime_words(s):
     """Decode MIME encoded words in headers."""
     try:
@@ -233,20 +1130,16 @@ def show_message_headers(folder_name, uid, username='user@example.com', password
     imap = connect_to_imap(username, password, server)
 
     try:
-        # Select the folder
-        result = imap.select(f'"{folder_name}"')
-        if result[0] != 'OK':
+        # Select the folder (read-only)
+        if select_folder(imap, folder_name) is None:
             print(f"Cannot select folder: {folder_name}")
-            imap.logout()
             return
 
         # Fetch the headers for the specified UID
-        msg_str = str(uid).encode() if isinstance(uid, int) else str(uid).encode()
-        status, msg_data = imap.fetch(msg_str, '(RFC822.HEADER)')
+        status, msg_data = imap.uid('FETCH', str(uid), '(BODY.PEEK[HEADER])')
 
-        if status != 'OK' or not msg_data or msg_data[0] is None:
+        if status != 'OK' or not msg_data or not isinstance(msg_data[0], tuple):
             print(f"Message UID {uid} not found in folder '{folder_name}'")
-            imap.logout()
             return
 
         # Get the raw header data
@@ -265,7 +1158,8 @@ def show_message_headers(folder_name, uid, username='user@example.com', password
         print(f"Error fetching message {uid} from folder {folder_name}: {str(e)}")
 
     finally:
-        imap.close()
+        if imap.state == 'SELECTED':
+            imap.close()
         imap.logout()
 
 def show_full_message(folder_name, uid, username='user@example.com', password='ChangeMe', server='mx.example.com'):
@@ -273,20 +1167,16 @@ def show_full_message(folder_name, uid, username='user@example.com', password='C
     imap = connect_to_imap(username, password, server)
 
     try:
-        # Select the folder
-        result = imap.select(f'"{folder_name}"')
-        if result[0] != 'OK':
+        # Select the folder (read-only)
+        if select_folder(imap, folder_name) is None:
             print(f"Cannot select folder: {folder_name}")
-            imap.logout()
             return
 
         # Fetch the complete message for the specified UID
-        msg_str = str(uid).encode() if isinstance(uid, int) else str(uid).encode()
-        status, msg_data = imap.fetch(msg_str, '(RFC822)')
+        status, msg_data = imap.uid('FETCH', str(uid), '(BODY.PEEK[])')
 
-        if status != 'OK' or not msg_data or msg_data[0] is None:
+        if status != 'OK' or not msg_data or not isinstance(msg_data[0], tuple):
             print(f"Message UID {uid} not found in folder '{folder_name}'")
-            imap.logout()
             return
 
         # Get the raw message data (headers + body)
@@ -305,7 +1195,8 @@ def show_full_message(folder_name, uid, username='user@example.com', password='C
         print(f"Error fetching message {uid} from folder {folder_name}: {str(e)}")
 
     finally:
-        imap.close()
+        if imap.state == 'SELECTED':
+            imap.close()
         imap.logout()
 
 def main():
@@ -314,6 +1205,7 @@ def main():
         epilog='''
 Examples:
   %(prog)s                              List all folders and message counts
+  %(prog)s --list --format csv          Folder inventory (messages, unseen, bytes) as CSV
   %(prog)s --ham                        Show latest 5 emails from INBOX
   %(prog)s --spam                       Show latest 5 emails from Junk Mail
   %(prog)s --folder "Sent"              Show latest 5 emails from any folder
@@ -321,6 +1213,11 @@ Examples:
   %(prog)s --ham --limit 10             Show latest 10 emails from INBOX
   %(prog)s --spam --headers 1234        Show all headers for message UID 1234 in Junk Mail
   %(prog)s --spam --message 1234        Show complete raw message (headers+body) for UID 1234
+  %(prog)s --accounts users.txt --master-user master --master-password secret --format csv
+                                        Folder inventory for every listed account, 8 at a time
+  %(prog)s --follow                     Print new arrivals in INBOX and Junk Mail as they are delivered
+  %(prog)s --spam --report              Symbol frequency, score histogram and top sender domains for Junk Mail
+  %(prog)s --spam --report --cache      Same, served from the local header cache (only new mail is fetched)
   %(prog)s --user user2@example.com --password ChangeMe --ham
                                         Use different account credentials
   %(prog)s --server mx.example.com --ham
@@ -352,9 +1249,11 @@ Workflow for debugging spam classification:
                         help='Display emails from specified folder')
     parser.add_argument('--list', action='store_true',
                         help='List all folders and their message counts (default if no other option)')
+    parser.add_argument('--format', choices=['table', 'csv', 'json'], default='table',
+                        help='Output format for --list and --report (default: table)')
 
     # Display options
-    parser.add_argument('--limit', type=int, default=5,
+    parser.add_argument('-n', '--limit', type=int, default=5,
                         help='Number of messages to display (default: 5)')
     parser.add_argument('--uid', action='store_true',
                         help='Show UID column in message table')
@@ -363,6 +1262,40 @@ Workflow for debugging spam classification:
     parser.add_argument('--message', type=int, metavar='UID',
                         help='Display complete raw message (headers + body) for specified UID')
 
+    # Multi-account inventory options
+    parser.add_argument('--accounts', metavar='FILE',
+                        help="Inventory every account listed in FILE ('user' or 'user:password' per line)")
+    parser.add_argument('--master-user',
+                        help='Master user to log in as each account (SASL PLAIN authzid)')
+    parser.add_argument('--master-password',
+                        help='Password for --master-user')
+    parser.add_argument('--workers', type=int, default=8,
+                        help='Accounts inventoried in parallel with --accounts (default: 8)')
+
+    # Follow options
+    parser.add_argument('--follow', nargs='*', metavar='FOLDER',
+                        help='Watch folders with IMAP IDLE and print each new message as it arrives '
+                             '(default: the --ham/--spam/--folder choice, else INBOX and Junk Mail)')
+    parser.add_argument('--poll-interval', type=int, default=30,
+                        help='Seconds between NOOP polls when the server has no IDLE (default: 30)')
+    parser.add_argument('--idle-timeout', type=int, default=1500,
+                        help='Seconds before IDLE is re-issued; keep it under the server limit (default: 1500)')
+
+    # Report options
+    parser.add_argument('--report', action='store_true',
+                        help='Aggregate symbol hits, score histogram and sender domains over a whole folder (default: Junk Mail)')
+    parser.add_argument('--top', type=int, default=20,
+                        help='Rows to show per report section (default: 20)')
+    parser.add_argument('--batch-size', type=int, default=1000,
+                        help='Messages per header FETCH in --report (default: 1000)')
+
+    # Cache options
+    parser.add_argument('--cache', action='store_true',
+                        help='Serve message lists and --report from a local SQLite header cache, fetching only new messages '
+                             '(not used by --list, --accounts, --follow, --headers or --message)')
+    parser.add_argument('--cache-file', default=DEFAULT_CACHE_FILE,
+                        help=f'Header cache location (default: {DEFAULT_CACHE_FILE.replace(os.path.expanduser("~"), "~")})')
+
     args = parser.parse_args()
 
     # Determine which folder to use
@@ -374,8 +1307,28 @@ Workflow for debugging spam classification:
     elif args.folder:
         folder = args.folder
 
+    # Only message lists and --report read headers; the cache has nothing to serve elsewhere
+    cache_used = args.follow is None and not args.accounts and (
+        args.report or (folder and not args.headers and not args.message))
+    if args.cache and not cache_used:
+        parser.error("--cache only applies to message lists (--ham/--spam/--folder) and --report")
+    cache = HeaderCache(args.cache_file) if args.cache else None
+
     # Execute the appropriate action
-    if args.headers:
+    if args.follow is not None:
+        folders = args.follow or ([folder] if folder else ['INBOX', 'Junk Mail'])
+        follow_folders(folders, args.user, args.password, args.server,
+                       idle_timeout=args.idle_timeout, poll_interval=args.poll_interval)
+    elif args.accounts:
+        accounts = read_accounts_file(args.accounts)
+        if not args.master_user and any(password is None for _, password in accounts):
+            parser.error("--accounts entries without a password need --master-user/--master-password")
+        rows = inventory_accounts(accounts, args.server, args.master_user, args.master_password, args.workers)
+        print_account_inventory(rows, args.format)
+    elif args.report:
+        report_folder(folder or 'Junk Mail', args.top, args.batch_size, args.format,
+                      args.user, args.password, args.server, cache)
+    elif args.headers:
         if not folder:
             # Default to INBOX if showing headers without specifying folder
             folder = 'INBOX'
@@ -386,9 +1339,12 @@ Workflow for debugging spam classification:
             folder = 'INBOX'
         show_full_message(folder, args.message, args.user, args.password, args.server)
     elif folder:
-        get_emails_from_folder(folder, args.limit, args.uid, args.user, args.password, args.server)
+        get_emails_from_folder(folder, args.limit, args.uid, args.user, args.password, args.server, cache)
     else:
-        list_folders(args.user, args.password, args.server)
+        list_folders(args.user, args.password, args.server, args.format)
+
+    if cache is not None:
+        cache.close()
 
 if __name__ == '__main__':
     main()
@@ -4,9 +4,13 @@ rspamd-spam-train.py - Train Rspamd Bayes classifier from Stalwart IMAP folders
 
 This script connects to Stalwart IMAP server, retrieves messages from designated
 spam and ham folders, and trains the Rspamd Bayes classifier via its HTTP API.
+With --stalwart-url, each message fetched from IMAP is also uploaded to
+Stalwart's built-in spam filter, so both Bayes backends stay trained from a
+single pass over the mailbox.
 
 Usage:
     ./rspamd-spam-train.py --train
+    ./rspamd-spam-train.py --daemon
     ./rspamd-spam-train.py --stats
     ./rspamd-spam-train.py --reset
 
@@ -21,9 +25,15 @@ import argparse
 import sys
 import json
 import os
+import select
+import ssl
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from email import policy
 from pathlib import Path
+from urllib.parse import quote
 
 # Configuration
 CONFIG = {
@@ -37,29 +47,223 @@ CONFIG = {
     'ham_folder': 'INBOX',
     'max_messages': 1000,  # Max messages to train per run
     'state_file': '/tmp/rspamd-train-state.json',
+    'checkpoint_every': 50,  # Save state every N trained messages
     'use_ssl': True,
+    'idle_timeout': 1500,  # Re-issue IDLE every 25 min (RFC 2177 says < 29 min)
+    'ham_interval': 3600,  # Daemon: seconds between incremental ham passes
+    'reconnect_max_delay': 300,  # Daemon: cap for reconnect backoff (seconds)
+    'sink_retries': 3,  # Attempts per message per training backend
+    'max_uid_attempts': 5,  # Failed passes before a message is skipped for good
+    'stalwart_url': None,  # e.g. https://mx.example.com to also train Stalwart
+    'stalwart_account': None,  # Per-account training (default: global)
+    'stalwart_user': None,  # Basic auth user (or use STALWART_TOKEN)
+    'stalwart_password': None,  # Will use STALWART_PASSWORD env var if unset
 }
 
+
+class TrainingSink(ABC):
+    """A Bayes backend that learns from raw messages
+    
+    Each sink keeps its own trained-UID lists in the state file (prefixed
+    with state_prefix) and retries failed uploads on its own, so one slow
+    or failing backend never causes the other to relearn messages.
+    """
+    name = 'sink'
+    state_prefix = ''
+    
+    def __init__(self, config):
+        self.config = config
+        self.trained_count = {'spam': 0, 'ham': 0}
+    
+    def state_key(self, msg_type):
+        return f"{self.state_prefix}{msg_type}_uids"
+    
+    @abstractmethod
+    def learn(self, message_data, is_spam):
+        """Train one raw message; True on success"""
+    
+    def learn_with_retry(self, message_data, is_spam):
+        """Learn a message, retrying with exponential backoff"""
+        attempts = max(1, self.config['sink_retries'])
+        for attempt in range(attempts):
+            if self.learn(message_data, is_spam):
+                return True
+            if attempt + 1 < attempts:
+                time.sleep(2 ** attempt)
+        return False
+
+
+class RspamdSink(TrainingSink):
+    """Rspamd controller learnspam/learnham"""
+    name = 'rspamd'
+    state_prefix = ''  # Unprefixed keys, compatible with older state files
+    
+    def learn(self, message_data, is_spam):
+        """Send message to rspamd for training"""
+        endpoint = 'learnspam' if is_spam else 'learnham'
+        url = f"{self.config['rspamd_url']}/{endpoint}"
+        
+        # Build headers with password if configured
+        headers = {'Content-Type': 'message/rfc822'}
+        
+        rspamd_password = self.config.get('rspamd_password') or os.getenv('RSPAMD_PASSWORD')
+        if rspamd_password:
+            headers['Password'] = rspamd_password
+        
+        try:
+            response = requests.post(
+                url,
+                data=message_data,
+                headers=headers,
+                timeout=10
+            )
+
+            # Success status codes:
+            # 200: Success with response
+            # 204: Success, no content
+            # 208: Already learned (still counts as success)
+            if response.status_code in [200, 204, 208]:
+                if response.status_code == 200:
+                    result = response.json()
+                    if result.get('success', False):
+                        return True
+                    # If JSON has success=false, still treat as warning but continue
+                    print(f"  Warning: {result.get('error', 'unknown error')}")
+                    return True
+                # 204 and 208 are success
+                return True
+            else:
+                print(f"  Warning: HTTP {response.status_code} - {response.text[:100]}")
+                return False
+        except Exception as e:
+            print(f"  Error training message: {e}")
+            return False
+
+
+class StalwartSink(TrainingSink):
+    """Stalwart built-in spam filter (/api/spam-filter/upload/{type}/{account})
+    
+    Stalwart 0.14.x only has /api/spam-filter/train/...; the endpoint is
+    auto-detected on the first upload, as in stalwart-spam-train.py.
+    """
+    name = 'stalwart'
+    state_prefix = 'stalwart_'
+    
+    def __init__(self, config):
+        super().__init__(config)
+        self.api_endpoint = None  # Auto-detected: 'upload' (0.15+) or 'train' (0.14.x)
+        self.session = requests.Session()
+        token = os.getenv('STALWART_TOKEN')
+        password = config.get('stalwart_password') or os.getenv('STALWART_PASSWORD')
+        if token:
+            self.session.headers['Authorization'] = f'Bearer {token}'
+        elif config.get('stalwart_user') and password:
+            self.session.auth = (config['stalwart_user'], password)
+        self.session.headers['Accept'] = 'application/json'
+    
+    def build_url(self, endpoint, train_type):
+        url = f"{self.config['stalwart_url'].rstrip('/')}/api/spam-filter/{endpoint}/{train_type}"
+        if self.config.get('stalwart_account'):
+            url += '/' + quote(self.config['stalwart_account'], safe='')
+        return url
+    
+    def learn(self, message_data, is_spam):
+        """Upload message to Stalwart for training"""
+        train_type = 'spam' if is_spam else 'ham'
+        
+        def post(endpoint):
+            return self.session.post(
+                self.build_url(endpoint, train_type),
+                data=message_data,
+                headers={'Content-Type': 'message/rfc822'},
+                timeout=30
+            )
+        
+        try:
+            if self.api_endpoint is None:
+                # Try the 0.15+ API first, fall back to the 0.14.x one on 404
+                response = post('upload')
+                if response.status_code == 404:
+                    self.api_endpoint = 'train'
+                    print("  Stalwart: /upload/ not found, using legacy /train/ API (0.14.x)")
+                    response = post('train')
+                else:
+                    self.api_endpoint = 'upload'
+            else:
+                response = post(self.api_endpoint)
+            if response.status_code in [200, 204]:
+                return True
+            print(f"  Warning: Stalwart HTTP {response.status_code} - {response.text[:100]}")
+            return False
+        except Exception as e:
+            print(f"  Error uploading message to Stalwart: {e}")
+            return False
+
 class RspamdTrainer:
     def __init__(self, config):
         self.config = config
         self.state = self.load_state()
         self.trained_count = {'spam': 0, 'ham': 0}
+        self.sinks = [RspamdSink(config)]
+        if config.get('stalwart_url'):
+            self.sinks.append(StalwartSink(config))
         
     def load_state(self):
-        """Load state of previously trained messages"""
-        if os.path.exists(self.config['state_file']):
-            with open(self.config['state_file'], 'r') as f:
-                return json.load(f)
-        return {'spam_uids': [], 'ham_uids': [], 'last_run': None}
+        """Load state of previously trained messages
+        
+        Trained UIDs are stored per folder as {folder: {uidvalidity, uids}},
+        so a UID recycled after UIDVALIDITY changes never matches an old one.
+        Flat UID lists from older state files belonged to the configured
+        folder for their message type and are converted on load.
+        """
+        if not os.path.exists(self.config['state_file']):
+            return {'spam_uids': {}, 'ham_uids': {}, 'last_run': None}
+        with open(self.config['state_file'], 'r') as f:
+            state = json.load(f)
+        uidvalidity = state.get('uidvalidity', {})
+        for msg_type in ('spam', 'ham'):
+            folder = self.config[f'{msg_type}_folder']
+            for prefix in ('', 'stalwart_'):
+                key = f"{prefix}{msg_type}_uids"
+                if isinstance(state.get(key), list):
+                    state[key] = {folder: {'uidvalidity': uidvalidity.get(folder), 'uids': state[key]}}
+        return state
+    
+    def trained_total(self, key):
+        """Number of trained UIDs under a state key, over all folders"""
+        return sum(len(entry.get('uids', [])) for entry in self.state.get(key, {}).values())
+    
+    def trained_uids(self, key, folder):
+        """UIDs of folder already trained under a state key (current UIDVALIDITY only)"""
+        entry = self.state.get(key, {}).get(folder)
+        if not entry:
+            return set()
+        # None: converted from an old state file that predates UIDVALIDITY tracking
+        if entry.get('uidvalidity') not in (None, self.state.get('uidvalidity', {}).get(folder)):
+            return set()
+        return set(entry.get('uids', []))
     
     def save_state(self):
-        """Save state of trained messages"""
+        """Save state of trained messages
+        
+        Written to a temp file and renamed over the old one, so a crash
+        mid-write never leaves a truncated state file behind.
+        """
         self.state['last_run'] = datetime.now().isoformat()
-        with open(self.config['state_file'], 'w') as f:
-            json.dump(self.state, f, indent=2)
+        state_file = self.config['state_file']
+        tmp_file = f"{state_file}.tmp"
+        try:
+            with open(tmp_file, 'w') as f:
+                json.dump(self.state, f, indent=2)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_file, state_file)
+        except BaseException:
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+            raise
     
-    def connect_imap(self):
+    def connect_imap(self, exit_on_error=True):
         """Connect to IMAP server"""
         try:
             if self.config['use_ssl']:
@@ -73,34 +277,67 @@ class RspamdTrainer:
                 password = getpass(f"IMAP Password for {self.config['imap_user']}: ")
             
             imap.login(self.config['imap_user'], password)
+            # Remember the password so daemon reconnects don't prompt again
+            self.config['imap_password'] = password
             print(f"✓ Connected to IMAP server as {self.config['imap_user']}")
             return imap
         except Exception as e:
             print(f"✗ IMAP connection failed: {e}")
+            if not exit_on_error:
+                raise
             sys.exit(1)
     
-    def get_message_uids(self, imap, folder):
-        """Get all message UIDs from a folder"""
+    def get_message_uids(self, imap, folder, since_uid=None):
+        """Get message UIDs from a folder (only UIDs above since_uid if given)"""
         try:
             # Add quotes around folder name if it contains spaces
-            if ' ' in folder:
-                folder = f'"{folder}"'
+            folder_name = f'"{folder}"' if ' ' in folder else folder
             
-            status, data = imap.select(folder, readonly=True)
+            status, data = imap.select(folder_name, readonly=True)
             if status != 'OK':
                 print(f"✗ Could not select folder: {folder}")
                 return []
             
-            status, data = imap.uid('search', None, 'ALL')
+            if self.check_uidvalidity(imap, folder):
+                since_uid = None  # old high-water mark means nothing in the new folder
+            
+            if since_uid is not None:
+                # "n:*" always matches the highest UID, even when it is below n
+                status, data = imap.uid('search', None, f'UID {since_uid + 1}:*')
+            else:
+                status, data = imap.uid('search', None, 'ALL')
             if status != 'OK':
                 return []
             
-            uids = data[0].split()
-            return [uid.decode() for uid in uids]
+            uids = [uid.decode() for uid in data[0].split()]
+            if since_uid is not None:
+                uids = [uid for uid in uids if int(uid) > since_uid]
+            return uids
         except Exception as e:
             print(f"✗ Error getting UIDs from {folder}: {e}")
             return []
     
+    def check_uidvalidity(self, imap, folder):
+        """Forget the folder's high-water mark and trained UIDs if UIDVALIDITY changed
+        
+        Returns True if it changed.
+        """
+        _, data = imap.response('UIDVALIDITY')
+        if not data or data[0] is None:
+            return False
+        uidvalidity = data[0].decode() if isinstance(data[0], bytes) else str(data[0])
+        folders = self.state.setdefault('uidvalidity', {})
+        changed = folders.get(folder) not in (None, uidvalidity)
+        if changed:
+            print(f"⚠ UIDVALIDITY changed for {folder}; rescanning folder")
+            self.state.setdefault('last_uid', {}).pop(folder, None)
+            self.state.get('failed_uids', {}).pop(folder, None)
+            for sink in self.sinks:
+                for msg_type in ('spam', 'ham'):
+                    self.state.get(sink.state_key(msg_type), {}).pop(folder, None)
+        folders[folder] = uidvalidity
+        return changed
+    
     def fetch_message(self, imap, uid):
         """Fetch a message by UID"""
         try:
@@ -112,72 +349,56 @@ class RspamdTrainer:
             print(f"✗ Error fetching message {uid}: {e}")
             return None
     
-    def train_rspamd(self, message_data, is_spam):
-        """Send message to rspamd for training"""
-        endpoint = 'learnspam' if is_spam else 'learnham'
-        url = f"{self.config['rspamd_url']}/{endpoint}"
-        
-        # Build headers with password if configured
-        headers = {'Content-Type': 'message/rfc822'}
-        
-        rspamd_password = self.config.get('rspamd_password') or os.getenv('RSPAMD_PASSWORD')
-        if rspamd_password:
-            headers['Password'] = rspamd_password
+    def train_folder(self, imap, folder, is_spam, incremental=False):
+        """Train all new messages from a folder
         
-        try:
-            response = requests.post(
-                url,
-                data=message_data,
-                headers=headers,
-                timeout=10
-            )
-
-            # Success status codes:
-            # 200: Success with response
-            # 204: Success, no content
-            # 208: Already learned (still counts as success)
-            if response.status_code in [200, 204, 208]:
-                if response.status_code == 200:
-                    result = response.json()
-                    if result.get('success', False):
-                        return True
-                    # If JSON has success=false, still treat as warning but continue
-                    print(f"  Warning: {result.get('error', 'unknown error')}")
-                    return True
-                # 204 and 208 are success
-                return True
-            else:
-                print(f"  Warning: HTTP {response.status_code} - {response.text[:100]}")
-                return False
-        except Exception as e:
-            print(f"  Error training message: {e}")
-            return False
-    
-    def train_folder(self, imap, folder, is_spam):
-        """Train all new messages from a folder"""
+        With incremental=True only UIDs above the folder's recorded
+        high-water mark are searched, instead of the whole folder.
+        """
         msg_type = "spam" if is_spam else "ham"
-        state_key = f"{msg_type}_uids"
         
         print(f"\n{'='*60}")
         print(f"Training {msg_type.upper()} from folder: {folder}")
         print(f"{'='*60}")
         
-        # Get all UIDs in folder
-        all_uids = self.get_message_uids(imap, folder)
+        # Get all UIDs in folder (or only those above the high-water mark)
+        since_uid = self.state.get('last_uid', {}).get(folder) if incremental else None
+        all_uids = self.get_message_uids(imap, folder, since_uid=since_uid)
         if not all_uids:
-            print(f"✗ No messages found in {folder}")
+            if since_uid is not None:
+                print(f"✓ No new messages in {folder}")
+            else:
+                print(f"✗ No messages found in {folder}")
             return
         
-        # Filter out already trained messages
-        trained_uids = set(self.state.get(state_key, []))
-        new_uids = [uid for uid in all_uids if uid not in trained_uids]
+        # Filter out messages already trained by every sink, and those that
+        # failed in max_uid_attempts passes (e.g. a message Rspamd always rejects)
+        trained = {sink.name: self.trained_uids(sink.state_key(msg_type), folder) for sink in self.sinks}
+        failures = dict(self.state.get('failed_uids', {}).get(folder, {}))
+        max_attempts = max(1, self.config['max_uid_attempts'])
+        
+        def given_up(uid):
+            return failures.get(uid, 0) >= max_attempts
+        
+        def record_failure(uid):
+            failures[uid] = failures.get(uid, 0) + 1
+            if given_up(uid):
+                print(f"  ✗ UID {uid} failed in {failures[uid]} passes; skipping it from now on")
+        
+        new_uids = [uid for uid in all_uids
+                    if not given_up(uid) and any(uid not in t for t in trained.values())]
         
         if not new_uids:
             print(f"✓ No new messages to train (all {len(all_uids)} already trained)")
+            last_uid = self.state.setdefault('last_uid', {})
+            last_uid[folder] = max([int(uid) for uid in all_uids] + [last_uid.get(folder) or 0])
             return
         
         print(f"Found {len(new_uids)} new messages to train (out of {len(all_uids)} total)")
         
+        # Oldest first, so the high-water mark never skips unprocessed UIDs
+        new_uids.sort(key=int)
+        
         # Limit messages if configured
         if len(new_uids) > self.config['max_messages']:
             print(f"Limiting to {self.config['max_messages']} messages")
@@ -187,26 +408,84 @@ class RspamdTrainer:
         folder_name = f'"{folder}"' if ' ' in folder else folder
         imap.select(folder_name, readonly=True)
         
-        # Train each message
+        def sync_state():
+            if failures:
+                self.state.setdefault('failed_uids', {})[folder] = dict(failures)
+            else:
+                self.state.get('failed_uids', {}).pop(folder, None)
+            for sink in self.sinks:
+                self.state.setdefault(sink.state_key(msg_type), {})[folder] = {
+                    'uidvalidity': self.state.get('uidvalidity', {}).get(folder),
+                    'uids': sorted(trained[sink.name], key=int),
+                }
+        
+        # Train each message: fetch once from IMAP, then hand it to every sink
+        # that still needs it. Sinks run in parallel, and overlap with the
+        # IMAP fetch of the next message.
         success_count = 0
-        for i, uid in enumerate(new_uids, 1):
-            msg_data = self.fetch_message(imap, uid)
-            if not msg_data:
-                continue
+        inflight = None
+        
+        def collect(i, uid, futures):
+            nonlocal success_count
+            ok = True
+            for sink, future in futures.items():
+                if future.result():
+                    trained[sink.name].add(uid)
+                    sink.trained_count[msg_type] += 1
+                else:
+                    print(f"  ✗ {sink.name}: giving up on UID {uid}")
+                    ok = False
+            if not ok:
+                record_failure(uid)
+                return
+            failures.pop(uid, None)
+            success_count += 1
             
-            if self.train_rspamd(msg_data, is_spam):
-                success_count += 1
-                trained_uids.add(uid)
-                
-                # Progress indicator
-                if i % 10 == 0 or i == len(new_uids):
-                    print(f"  Progress: {i}/{len(new_uids)} messages trained")
+            # Checkpoint so an interrupted run loses at most one batch
+            if success_count % self.config['checkpoint_every'] == 0:
+                sync_state()
+                self.save_state()
+            
+            # Progress indicator
+            if i % 10 == 0 or i == len(new_uids):
+                print(f"  Progress: {i}/{len(new_uids)} messages trained")
+        
+        try:
+            with ThreadPoolExecutor(max_workers=len(self.sinks)) as pool:
+                for i, uid in enumerate(new_uids, 1):
+                    msg_data = self.fetch_message(imap, uid)
+                    if inflight:
+                        collect(*inflight)
+                        inflight = None
+                    if not msg_data:
+                        record_failure(uid)
+                        continue
+                    
+                    futures = {
+                        sink: pool.submit(sink.learn_with_retry, msg_data, is_spam)
+                        for sink in self.sinks if uid not in trained[sink.name]
+                    }
+                    inflight = (i, uid, futures)
+                if inflight:
+                    collect(*inflight)
+        finally:
+            # Keep progress even if interrupted mid-folder
+            sync_state()
         
-        # Update state
-        self.state[state_key] = list(trained_uids)
-        self.trained_count[msg_type] = success_count
+        # Update state; stop the high-water mark below the first UID some sink
+        # still needs (failed, unfetched or over max_messages) so it is retried
+        owed = [int(uid) for uid in all_uids
+                if not given_up(uid) and any(uid not in t for t in trained.values())]
+        high_water = min(owed) - 1 if owed else max(int(uid) for uid in all_uids)
+        self.state.setdefault('last_uid', {})[folder] = max(
+            high_water, self.state.get('last_uid', {}).get(folder) or 0
+        )
+        self.trained_count[msg_type] += success_count
         
         print(f"✓ Successfully trained {success_count}/{len(new_uids)} {msg_type} messages")
+        if len(self.sinks) > 1:
+            for sink in self.sinks:
+                print(f"  {sink.name}: {self.trained_total(sink.state_key(msg_type))} {msg_type} messages trained in total")
     
     def get_rspamd_stats(self):
         """Get Bayes statistics from rspamd"""
@@ -234,14 +513,17 @@ class RspamdTrainer:
             print(json.dumps(stats, indent=2))
         
         print("\nLocal Training State:")
-        print(f"  Spam messages trained: {len(self.state.get('spam_uids', []))}")
-        print(f"  Ham messages trained: {len(self.state.get('ham_uids', []))}")
+        print(f"  Spam messages trained: {self.trained_total('spam_uids')}")
+        print(f"  Ham messages trained: {self.trained_total('ham_uids')}")
+        if self.trained_total('stalwart_spam_uids') or self.trained_total('stalwart_ham_uids'):
+            print(f"  Stalwart spam messages trained: {self.trained_total('stalwart_spam_uids')}")
+            print(f"  Stalwart ham messages trained: {self.trained_total('stalwart_ham_uids')}")
         print(f"  Last training run: {self.state.get('last_run', 'Never')}")
         
-        if len(self.state.get('spam_uids', [])) < 200 or len(self.state.get('ham_uids', [])) < 200:
+        if self.trained_total('spam_uids') < 200 or self.trained_total('ham_uids') < 200:
             print("\n⚠ Warning: Bayes requires at least 200 spam and 200 ham messages to activate")
-            print(f"  Need {max(0, 200 - len(self.state.get('spam_uids', [])))} more spam messages")
-            print(f"  Need {max(0, 200 - len(self.state.get('ham_uids', [])))} more ham messages")
+            print(f"  Need {max(0, 200 - self.trained_total('spam_uids'))} more spam messages")
+            print(f"  Need {max(0, 200 - self.trained_total('ham_uids'))} more ham messages")
     
     def reset_state(self):
         """Reset training state (does not untrain rspamd)"""
@@ -251,12 +533,134 @@ class RspamdTrainer:
         
         response = input("\nAre you sure? (yes/no): ")
         if response.lower() == 'yes':
-            self.state = {'spam_uids': [], 'ham_uids': [], 'last_run': None}
+            self.state = {'spam_uids': {}, 'ham_uids': {}, 'last_run': None}
             self.save_state()
             print("✓ State file reset")
         else:
             print("Cancelled")
     
+    def idle_data_buffered(self, imap):
+        """Check for IDLE data that select() on the raw socket cannot see
+        
+        imaplib reads through a buffered file object, so the line after
+        "+ idling" may already sit in the Python buffer (and TLS may hold
+        decrypted bytes). Peeks without blocking.
+        """
+        sock = imap.socket()
+        if hasattr(sock, 'pending') and sock.pending():
+            return True
+        timeout = sock.gettimeout()
+        sock.setblocking(False)
+        try:
+            return bool(imap.file.peek(1))
+        except (BlockingIOError, ssl.SSLWantReadError):
+            return False
+        finally:
+            sock.settimeout(timeout)
+    
+    def idle_wait(self, imap, timeout):
+        """Hold IMAP IDLE on the selected folder until it changes or timeout expires
+        
+        Returns True if the server reported new messages (EXISTS/RECENT).
+        """
+        tag = imap._new_tag()
+        imap.send(tag + b' IDLE\r\n')
+        line = imap.readline()
+        if not line.startswith(b'+'):
+            raise imaplib.IMAP4.error(f"IDLE rejected: {line.decode(errors='replace').strip()}")
+        
+        changed = False
+        sock = imap.socket()
+        deadline = time.monotonic() + timeout
+        while not changed:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            if not self.idle_data_buffered(imap):
+                readable, _, _ = select.select([sock], [], [], remaining)
+                if not readable:
+                    break
+            line = imap.readline()
+            if not line:
+                raise imaplib.IMAP4.abort("connection closed during IDLE")
+            if line.startswith(b'*') and (b'EXISTS' in line or b'RECENT' in line):
+                changed = True
+        
+        imap.send(b'DONE\r\n')
+        while True:
+            line = imap.readline()
+            if not line:
+                raise imaplib.IMAP4.abort("connection closed while ending IDLE")
+            if line.startswith(tag):
+                break
+            if line.startswith(b'*') and b'EXISTS' in line:
+                changed = True
+        return changed
+    
+    def run_daemon(self):
+        """Stay connected and learn new spam as soon as it lands in the spam folder
+        
+        Holds IMAP IDLE on the spam folder (or polls with NOOP if the server
+        has no IDLE), trains only UIDs above the recorded high-water mark, and
+        checkpoints state after every pass. Ham is trained incrementally every
+        ham_interval seconds. Lost connections are retried with exponential
+        backoff.
+        """
+        print("Rspamd Bayes Training Daemon")
+        print(f"Started at: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+        
+        spam_folder = self.config['spam_folder']
+        ham_folder = self.config['ham_folder']
+        delay = 5
+        last_ham = 0.0
+        
+        while True:
+            imap = None
+            try:
+                imap = self.connect_imap(exit_on_error=False)
+                delay = 5
+                
+                while True:
+                    if time.monotonic() - last_ham >= self.config['ham_interval']:
+                        self.train_folder(imap, ham_folder, is_spam=False, incremental=True)
+                        last_ham = time.monotonic()
+                    self.train_folder(imap, spam_folder, is_spam=True, incremental=True)
+                    self.save_state()
+                    
+                    # train_folder leaves the spam folder selected
+                    wait = min(self.config['idle_timeout'],
+                               max(1, self.config['ham_interval'] - (time.monotonic() - last_ham)))
+                    if 'IDLE' in imap.capabilities:
+                        print(f"Waiting for new messages in {spam_folder} (IDLE)...")
+                        self.idle_wait(imap, wait)
+                    else:
+                        print(f"Server lacks IDLE; polling {spam_folder} every {wait:.0f}s")
+                        time.sleep(wait)
+                        imap.noop()
+            except KeyboardInterrupt:
+                print("\nStopping daemon")
+                self.save_state()
+                if imap is not None:
+                    try:
+                        imap.logout()
+                    except Exception:
+                        pass
+                return
+            except Exception as e:
+                print(f"✗ Connection lost: {e}; reconnecting in {delay}s")
+                self.save_state()
+                if imap is not None:
+                    try:
+                        imap.shutdown()
+                    except Exception:
+                        pass
+                try:
+                    time.sleep(delay)
+                except KeyboardInterrupt:
+                    print("\nStopping daemon")
+                    return
+                delay = min(delay * 2, self.config['reconnect_max_delay'])
+    
     def train(self):
         """Main training function"""
         print("Rspamd Bayes Training Script")
@@ -266,14 +670,15 @@ class RspamdTrainer:
         imap = self.connect_imap()
         
         try:
-            # Train spam
-            self.train_folder(imap, self.config['spam_folder'], is_spam=True)
-            
-            # Train ham
-            self.train_folder(imap, self.config['ham_folder'], is_spam=False)
-            
-            # Save state
-            self.save_state()
+            try:
+                # Train spam
+                self.train_folder(imap, self.config['spam_folder'], is_spam=True)
+                
+                # Train ham
+                self.train_folder(imap, self.config['ham_folder'], is_spam=False)
+            finally:
+                # Save state (also on Ctrl-C/crash; checkpoints cover the rest)
+                self.save_state()
             
             # Print summary
             print(f"\n{'='*60}")
@@ -281,15 +686,18 @@ class RspamdTrainer:
             print(f"{'='*60}")
             print(f"Spam messages trained this run: {self.trained_count['spam']}")
             print(f"Ham messages trained this run: {self.trained_count['ham']}")
-            print(f"Total spam trained: {len(self.state['spam_uids'])}")
-            print(f"Total ham trained: {len(self.state['ham_uids'])}")
+            print(f"Total spam trained: {self.trained_total('spam_uids')}")
+            print(f"Total ham trained: {self.trained_total('ham_uids')}")
+            for sink in self.sinks[1:]:
+                print(f"{sink.name.capitalize()}: {sink.trained_count['spam']} spam, "
+                      f"{sink.trained_count['ham']} ham uploaded this run")
             
-            if len(self.state['spam_uids']) >= 200 and len(self.state['ham_uids']) >= 200:
+            if self.trained_total('spam_uids') >= 200 and self.trained_total('ham_uids') >= 200:
                 print("\n✓ Bayes classifier has sufficient training data")
             else:
                 print(f"\n⚠ Need more training data:")
-                print(f"  Spam: {max(0, 200 - len(self.state['spam_uids']))} more needed")
-                print(f"  Ham: {max(0, 200 - len(self.state['ham_uids']))} more needed")
+                print(f"  Spam: {max(0, 200 - self.trained_total('spam_uids'))} more needed")
+                print(f"  Ham: {max(0, 200 - self.trained_total('ham_uids'))} more needed")
             
         finally:
             imap.logout()
@@ -301,6 +709,7 @@ def main():
         epilog="""
 Examples:
   %(prog)s --train              Train from new messages
+  %(prog)s --daemon             Stay connected and learn new spam via IMAP IDLE
   %(prog)s --stats              Show training statistics
   %(prog)s --reset              Reset training state
 
@@ -313,15 +722,20 @@ Examples:
   # Override spam folder
   %(prog)s --train --spam-folder "Junk Mail"
 
+  # Also train Stalwart's built-in filter from the same IMAP pass
+  %(prog)s --train --stalwart-url https://mx.example.com --stalwart-account user@domain.com
+
 Configuration Priority (highest to lowest):
   1. Command-line arguments (--imap-user, --imap-password)
-  2. Environment variables (IMAP_PASSWORD, RSPAMD_PASSWORD)
+  2. Environment variables (IMAP_PASSWORD, RSPAMD_PASSWORD, STALWART_TOKEN, STALWART_PASSWORD)
   3. CONFIG dictionary in the script
         """
     )
     
     parser.add_argument('--train', action='store_true',
                        help='Train Bayes from IMAP folders')
+    parser.add_argument('--daemon', action='store_true',
+                       help='Run continuously, learning new spam via IMAP IDLE')
     parser.add_argument('--stats', action='store_true',
                        help='Show training statistics')
     parser.add_argument('--reset', action='store_true',
@@ -336,6 +750,22 @@ Configuration Priority (highest to lowest):
                        help=f"Ham folder name (default: {CONFIG['ham_folder']})")
     parser.add_argument('--max', type=int, default=CONFIG['max_messages'],
                        help=f"Max messages per run (default: {CONFIG['max_messages']})")
+    parser.add_argument('--checkpoint-every', type=int, default=CONFIG['checkpoint_every'],
+                       help=f"Save state every N trained messages (default: {CONFIG['checkpoint_every']})")
+    parser.add_argument('--stalwart-url',
+                       help='Also train Stalwart spam filter at this URL (fetch once, train both)')
+    parser.add_argument('--stalwart-account',
+                       help='Stalwart account for per-user training (default: global)')
+    parser.add_argument('--stalwart-user',
+                       help='Stalwart admin user for basic auth (or set STALWART_TOKEN)')
+    parser.add_argument('--stalwart-password',
+                       help='Stalwart admin password (or set STALWART_PASSWORD)')
+    parser.add_argument('--max-uid-attempts', type=int, default=CONFIG['max_uid_attempts'],
+                       help=f"Skip a message after it failed in N training passes (default: {CONFIG['max_uid_attempts']})")
+    parser.add_argument('--idle-timeout', type=int, default=CONFIG['idle_timeout'],
+                       help=f"Daemon: seconds before re-issuing IDLE (default: {CONFIG['idle_timeout']})")
+    parser.add_argument('--ham-interval', type=int, default=CONFIG['ham_interval'],
+                       help=f"Daemon: seconds between ham passes (default: {CONFIG['ham_interval']})")
 
     args = parser.parse_args()
 
@@ -347,6 +777,18 @@ Configuration Priority (highest to lowest):
     CONFIG['spam_folder'] = args.spam_folder
     CONFIG['ham_folder'] = args.ham_folder
     CONFIG['max_messages'] = args.max
+    CONFIG['checkpoint_every'] = max(1, args.checkpoint_every)
+    if args.stalwart_url:
+        CONFIG['stalwart_url'] = args.stalwart_url
+    if args.stalwart_account:
+        CONFIG['stalwart_account'] = args.stalwart_account
+    if args.stalwart_user:
+        CONFIG['stalwart_user'] = args.stalwart_user
+    if args.stalwart_password:
+        CONFIG['stalwart_password'] = args.stalwart_password
+    CONFIG['max_uid_attempts'] = max(1, args.max_uid_attempts)
+    CONFIG['idle_timeout'] = args.idle_timeout
+    CONFIG['ham_interval'] = args.ham_interval
     
     # Create trainer
     trainer = RspamdTrainer(CONFIG)
@@ -354,6 +796,8 @@ Configuration Priority (highest to lowest):
     # Execute command
     if args.train:
         trainer.train()
+    elif args.daemon:
+        trainer.run_daemon()
     elif args.stats:
         trainer.print_stats()
     elif args.reset:
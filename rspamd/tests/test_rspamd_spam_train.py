@@ -0,0 +1,297 @@
+import importlib.machinery
+import importlib.util
+import json
+import pathlib
+import socket
+import sys
+import tempfile
+import time
+import unittest
+
+
+def load_module():
+    path = pathlib.Path(__file__).resolve().parents[1] / "rspamd-spam-train.py"
+    loader = importlib.machinery.SourceFileLoader("rspamd_spam_train", str(path))
+    spec = importlib.util.spec_from_loader(loader.name, loader)
+    assert spec and spec.loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[loader.name] = module
+    spec.loader.exec_module(module)  # type: ignore[attr-defined]
+    return module
+
+
+RT = load_module()
+
+
+class FakeImap:
+    """One folder with a UIDVALIDITY and {uid: message} contents."""
+
+    def __init__(self, uidvalidity: str, messages: dict[str, bytes]) -> None:
+        self.uidvalidity = uidvalidity
+        self.messages = messages
+
+    def select(self, folder, readonly=False):  # noqa: ANN001
+        return "OK", [str(len(self.messages)).encode()]
+
+    def response(self, code):  # noqa: ANN001
+        return code, [self.uidvalidity.encode()]
+
+    def uid(self, command, *args):  # noqa: ANN001
+        if command == "search":
+            return "OK", [" ".join(sorted(self.messages, key=int)).encode()]
+        if command == "fetch":
+            return "OK", [(b"", self.messages[args[0]])]
+        raise AssertionError(command)
+
+
+class SocketImap:
+    """Just enough of imaplib.IMAP4 for IDLE: a buffered reader over a socket."""
+
+    def __init__(self, sock: socket.socket) -> None:
+        self.sock = sock
+        self.file = sock.makefile("rb")
+
+    def _new_tag(self) -> bytes:
+        return b"A1"
+
+    def send(self, data: bytes) -> None:
+        self.sock.sendall(data)
+
+    def readline(self) -> bytes:
+        return self.file.readline()
+
+    def socket(self) -> socket.socket:
+        return self.sock
+
+
+class RecordingSink(RT.TrainingSink):
+    name = "rspamd"
+    state_prefix = ""
+
+    def __init__(self, config, *, rejects: set[bytes] = frozenset()) -> None:  # noqa: ANN001
+        super().__init__(config)
+        self.rejects = set(rejects)
+        self.attempts: list[bytes] = []
+        self.learned: list[bytes] = []
+
+    def learn(self, message_data, is_spam):  # noqa: ANN001
+        self.attempts.append(message_data)
+        if message_data in self.rejects:
+            return False
+        self.learned.append(message_data)
+        return True
+
+
+class StalwartRecordingSink(RecordingSink):
+    name = "stalwart"
+    state_prefix = "stalwart_"
+
+
+class FakeResponse:
+    def __init__(self, status_code: int) -> None:
+        self.status_code = status_code
+        self.text = ""
+
+
+class FakeTime:
+    """Stands in for the time module inside rspamd-spam-train.py: sleeps are recorded, not slept."""
+
+    def __init__(self) -> None:
+        self.slept: list[float] = []
+
+    def sleep(self, seconds: float) -> None:
+        self.slept.append(seconds)
+
+    def monotonic(self) -> float:
+        return time.monotonic()
+
+
+class TestRspamdSpamTrain(unittest.TestCase):
+    def trainer(self, state_file: pathlib.Path, **config_overrides):  # noqa: ANN003
+        config = dict(RT.CONFIG, state_file=str(state_file), spam_folder="Junk", ham_folder="INBOX", **config_overrides)
+        trainer = RT.RspamdTrainer(config)
+        trainer.sinks = [RecordingSink(config)]
+        return trainer
+
+    def test_training_sink_requires_learn(self) -> None:
+        with self.assertRaises(TypeError):
+            RT.TrainingSink(RT.CONFIG)  # type: ignore[abstract]
+
+    def test_learn_with_retry_backs_off_per_sink(self) -> None:
+        fake_time = FakeTime()
+        orig_time, RT.time = RT.time, fake_time
+        try:
+            config = dict(RT.CONFIG, sink_retries=3)
+            sink = RecordingSink(config, rejects={b"m"})
+            self.assertFalse(sink.learn_with_retry(b"m", True))
+            self.assertEqual((len(sink.attempts), fake_time.slept), (3, [1, 2]))
+
+            class SecondTimeLucky(RecordingSink):
+                def learn(self, message_data, is_spam):  # noqa: ANN001
+                    if not self.attempts:
+                        self.attempts.append(message_data)
+                        return False
+                    return super().learn(message_data, is_spam)
+
+            fake_time.slept.clear()
+            sink = SecondTimeLucky(config)
+            self.assertTrue(sink.learn_with_retry(b"m", True))
+            self.assertEqual((len(sink.attempts), sink.learned, fake_time.slept), (2, [b"m"], [1]))
+        finally:
+            RT.time = orig_time
+
+    def test_stalwart_sink_falls_back_to_legacy_train_endpoint(self) -> None:
+        config = dict(RT.CONFIG, stalwart_url="https://mx.test/", stalwart_account="a@b.test")
+        sink = RT.StalwartSink(config)
+        urls: list[str] = []
+
+        def post(url, **_kw):  # noqa: ANN001, ANN003
+            urls.append(url)
+            return FakeResponse(404 if "/upload/" in url else 200)
+
+        sink.session.post = post  # type: ignore[method-assign]
+        self.assertTrue(sink.learn(b"m1", True))
+        self.assertTrue(sink.learn(b"m2", False))
+        self.assertEqual(
+            urls,
+            [
+                "https://mx.test/api/spam-filter/upload/spam/a%40b.test",
+                "https://mx.test/api/spam-filter/train/spam/a%40b.test",
+                # Detected once; later uploads go straight to the legacy endpoint.
+                "https://mx.test/api/spam-filter/train/ham/a%40b.test",
+            ],
+        )
+
+    def test_one_failing_sink_does_not_block_the_other(self) -> None:
+        with tempfile.TemporaryDirectory() as tmp:
+            state_file = pathlib.Path(tmp) / "state.json"
+            folder = {"1": b"m1", "2": b"m2", "3": b"m3"}
+            trainer = self.trainer(state_file, sink_retries=1)
+            rspamd, stalwart = RecordingSink(trainer.config), StalwartRecordingSink(trainer.config, rejects={b"m2"})
+            trainer.sinks = [rspamd, stalwart]
+            trainer.train_folder(FakeImap("100", folder), "Junk", is_spam=True, incremental=True)
+            trainer.save_state()
+
+            self.assertEqual(rspamd.learned, [b"m1", b"m2", b"m3"])
+            self.assertEqual(stalwart.learned, [b"m1", b"m3"])
+            state = json.loads(state_file.read_text())
+            self.assertEqual(state["spam_uids"]["Junk"]["uids"], ["1", "2", "3"])
+            self.assertEqual(state["stalwart_spam_uids"]["Junk"]["uids"], ["1", "3"])
+            # The high-water mark stays below the UID a sink still owes.
+            self.assertEqual(state["last_uid"]["Junk"], 1)
+
+            # Next pass: only the sink that missed UID 2 gets it, nothing is relearned.
+            trainer = self.trainer(state_file, sink_retries=1)
+            rspamd, stalwart = RecordingSink(trainer.config), StalwartRecordingSink(trainer.config)
+            trainer.sinks = [rspamd, stalwart]
+            trainer.train_folder(FakeImap("100", folder), "Junk", is_spam=True, incremental=True)
+            self.assertEqual((rspamd.attempts, stalwart.learned), ([], [b"m2"]))
+            self.assertEqual(trainer.state["last_uid"]["Junk"], 3)
+
+    def test_recycled_uid_after_uidvalidity_change_is_trained(self) -> None:
+        with tempfile.TemporaryDirectory() as tmp:
+            state_file = pathlib.Path(tmp) / "state.json"
+            trainer = self.trainer(state_file)
+            trainer.train_folder(FakeImap("100", {"1": b"old-1", "2": b"old-2"}), "Junk", is_spam=True)
+            trainer.save_state()
+            self.assertEqual(trainer.sinks[0].learned, [b"old-1", b"old-2"])
+
+            # Same UIDVALIDITY: nothing new to learn.
+            trainer = self.trainer(state_file)
+            trainer.train_folder(FakeImap("100", {"1": b"old-1", "2": b"old-2"}), "Junk", is_spam=True)
+            self.assertEqual(trainer.sinks[0].learned, [])
+
+            # Folder recreated: UID 1 now names a different message and must be learned.
+            trainer = self.trainer(state_file)
+            trainer.train_folder(FakeImap("200", {"1": b"new-1"}), "Junk", is_spam=True, incremental=True)
+            trainer.save_state()
+            self.assertEqual(trainer.sinks[0].learned, [b"new-1"])
+            state = json.loads(state_file.read_text())
+            self.assertEqual(state["spam_uids"], {"Junk": {"uidvalidity": "200", "uids": ["1"]}})
+            self.assertEqual(trainer.trained_total("spam_uids"), 1)
+
+    def test_flat_uid_lists_from_old_state_files_are_kept(self) -> None:
+        with tempfile.TemporaryDirectory() as tmp:
+            state_file = pathlib.Path(tmp) / "state.json"
+            state_file.write_text(json.dumps({"spam_uids": ["1", "2"], "ham_uids": [], "last_run": None}))
+            trainer = self.trainer(state_file)
+            self.assertEqual(trainer.state["spam_uids"], {"Junk": {"uidvalidity": None, "uids": ["1", "2"]}})
+            trainer.train_folder(FakeImap("100", {"1": b"m1", "2": b"m2", "3": b"m3"}), "Junk", is_spam=True)
+            self.assertEqual(trainer.sinks[0].learned, [b"m3"])
+
+    def test_idle_event_buffered_with_continuation_is_seen(self) -> None:
+        client, server = socket.socketpair()
+        with client, server:
+            # The server's first write carries the EXISTS right behind "+ idling",
+            # so it lands in imaplib's read buffer rather than on the socket.
+            server.sendall(b"+ idling\r\n* 3 EXISTS\r\nA1 OK IDLE done\r\n")
+            with tempfile.TemporaryDirectory() as tmp:
+                trainer = self.trainer(pathlib.Path(tmp) / "state.json")
+            started = time.monotonic()
+            self.assertTrue(trainer.idle_wait(SocketImap(client), timeout=5))
+            self.assertLess(time.monotonic() - started, 1)
+
+    def test_interrupted_run_resumes_after_last_checkpoint(self) -> None:
+        class Interrupt(RecordingSink):
+            def learn(self, message_data, is_spam):  # noqa: ANN001
+                if message_data == b"m3":
+                    raise KeyboardInterrupt
+                return super().learn(message_data, is_spam)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            state_file = pathlib.Path(tmp) / "state.json"
+            folder = {str(i): f"m{i}".encode() for i in range(1, 6)}
+            trainer = self.trainer(state_file, checkpoint_every=2)
+            trainer.sinks = [Interrupt(trainer.config)]
+            with self.assertRaises(KeyboardInterrupt):
+                trainer.train_folder(FakeImap("100", folder), "Junk", is_spam=True)
+            # Nothing saved after the interruption: the checkpoint after m2 is what is on disk.
+            self.assertEqual(json.loads(state_file.read_text())["spam_uids"]["Junk"]["uids"], ["1", "2"])
+
+            trainer = self.trainer(state_file, checkpoint_every=2)
+            trainer.train_folder(FakeImap("100", folder), "Junk", is_spam=True)
+            self.assertEqual(trainer.sinks[0].learned, [b"m3", b"m4", b"m5"])
+
+    def test_failed_save_keeps_previous_state_file(self) -> None:
+        with tempfile.TemporaryDirectory() as tmp:
+            state_file = pathlib.Path(tmp) / "state.json"
+            trainer = self.trainer(state_file)
+            trainer.train_folder(FakeImap("100", {"1": b"m1"}), "Junk", is_spam=True)
+            trainer.save_state()
+            saved = state_file.read_text()
+
+            # json.dump fails halfway through writing the new state.
+            trainer.state["spam_uids"]["Junk"]["uids"].append(object())
+            with self.assertRaises(TypeError):
+                trainer.save_state()
+            self.assertEqual(state_file.read_text(), saved)
+            self.assertEqual(sorted(p.name for p in pathlib.Path(tmp).iterdir()), ["state.json"])
+
+    def test_uid_failing_every_pass_is_skipped_after_max_attempts(self) -> None:
+        with tempfile.TemporaryDirectory() as tmp:
+            state_file = pathlib.Path(tmp) / "state.json"
+            folder = {"1": b"m1", "2": b"bad", "3": b"m3"}
+
+            def run_pass() -> RecordingSink:
+                trainer = self.trainer(state_file, sink_retries=1, max_uid_attempts=2)
+                trainer.sinks = [RecordingSink(trainer.config, rejects={b"bad"})]
+                trainer.train_folder(FakeImap("100", folder), "Junk", is_spam=True, incremental=True)
+                trainer.save_state()
+                return trainer.sinks[0]
+
+            run_pass()
+            state = json.loads(state_file.read_text())
+            self.assertEqual((state["last_uid"]["Junk"], state["failed_uids"]), (1, {"Junk": {"2": 1}}))
+
+            # Second failed pass: give up on UID 2 and move the high-water mark past it.
+            self.assertEqual(run_pass().attempts, [b"bad"])
+            state = json.loads(state_file.read_text())
+            self.assertEqual((state["last_uid"]["Junk"], state["failed_uids"]), (3, {"Junk": {"2": 2}}))
+
+            folder["4"] = b"m4"
+            self.assertEqual(run_pass().attempts, [b"m4"])
+            self.assertEqual(json.loads(state_file.read_text())["last_uid"]["Junk"], 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,210 @@
+import contextlib
+import importlib.machinery
+import importlib.util
+import io
+import json
+import pathlib
+import subprocess
+import sys
+import tempfile
+import types
+import unittest
+
+
+def load_smmailbox_module():
+    smmailbox_path = pathlib.Path(__file__).resolve().parents[1] / "smmailbox"
+    loader = importlib.machinery.SourceFileLoader("smmailbox", str(smmailbox_path))
+    spec = importlib.util.spec_from_loader(loader.name, loader)
+    assert spec and spec.loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[loader.name] = module
+    spec.loader.exec_module(module)  # type: ignore[attr-defined]
+    return module
+
+
+SM = load_smmailbox_module()
+
+# Stands in for the per-account smmailbox child: writes the summary, fails for "bad*" users.
+STUB_CHILD = """
+import json, sys
+argv = sys.argv[1:]
+user = argv[argv.index("--src-user") + 1]
+summary = argv[argv.index("--summary-json") + 1]
+with open(summary, "w") as f:
+    json.dump({"steps": [{"name": "imapsync", "user": user}]}, f)
+sys.exit(3 if user.startswith("bad") else 0)
+"""
+
+
+class TestSmMailboxBatch(unittest.TestCase):
+    def read_accounts(self, text: str, **kw):  # noqa: ANN003
+        with tempfile.TemporaryDirectory() as tmp:
+            path = pathlib.Path(tmp) / "accounts.csv"
+            path.write_text(text, encoding="utf-8")
+            return SM.read_batch_accounts(
+                path,
+                src_host=kw.get("src_host", "zimbra.test"),
+                dst_host=kw.get("dst_host", "stalwart.test"),
+                secret_defaults={"src_password_env": "ZP", "dst_password_file": "/etc/dst.pass"},
+            )
+
+    def test_parse_batch_size(self) -> None:
+        self.assertEqual(SM.parse_batch_size("123456"), 123456)
+        self.assertEqual(SM.parse_batch_size("1.5G"), 1536 * 1024 * 1024)
+        self.assertEqual(SM.parse_batch_size("300 MB"), 300 * 1024 * 1024)
+        self.assertEqual(SM.parse_batch_size("2KiB"), 2048)
+        self.assertIsNone(SM.parse_batch_size(" "))
+        with self.assertRaises(ValueError):
+            SM.parse_batch_size("lots")
+
+    def test_read_batch_accounts(self) -> None:
+        accounts = self.read_accounts(
+            "Src-User,dst_user,dst_host,size,src_password_file,args\n"
+            "# staff\n"
+            "\n"
+            "a@example.com,,,2G,,\n"
+            "B@example.com,b@new.example.com,other.test,,/etc/b.pass,--no-calendars --contacts-limit 5\n"
+        )
+        a, b = accounts
+        self.assertEqual(
+            (a.key, a.dst_user, a.src_host, a.dst_host, a.size),
+            ("a@example.com", "a@example.com", "zimbra.test", "stalwart.test", 2 * 1024**3),
+        )
+        self.assertEqual(a.secret_args, ("--src-password-env", "ZP", "--dst-password-file", "/etc/dst.pass"))
+        self.assertEqual((b.key, b.dst_user, b.dst_host, b.size), ("b@example.com", "b@new.example.com", "other.test", None))
+        # The row's own password file replaces the batch-level env var for the source side only.
+        self.assertEqual(b.secret_args, ("--src-password-file", "/etc/b.pass", "--dst-password-file", "/etc/dst.pass"))
+        self.assertEqual(b.extra_args, ("--no-calendars", "--contacts-limit", "5"))
+
+    def test_read_batch_accounts_errors(self) -> None:
+        with self.assertRaisesRegex(SystemExit, "unknown column"):
+            self.read_accounts("src_user,password\na@x,secret\n")
+        with self.assertRaisesRegex(SystemExit, "duplicate account"):
+            self.read_accounts("src_user\na@x\nA@x\n")
+        with self.assertRaisesRegex(SystemExit, "no source/destination host"):
+            self.read_accounts("src_user\na@x\n", dst_host=None)
+        with self.assertRaisesRegex(SystemExit, "invalid size"):
+            self.read_accounts("src_user,size\na@x,big\n")
+
+    def test_longest_first_with_host_caps(self) -> None:
+        def acct(key: str, size, src: str, dst: str = "st"):  # noqa: ANN001
+            return SM.BatchAccount(
+                key=key, src_user=key, dst_user=key, src_host=src, dst_host=dst, size=size, secret_args=(), extra_args=()
+            )
+
+        pending = SM.batch_schedule_order(
+            [acct("small", 10, "z1"), acct("unknown", None, "z2"), acct("big", 1000, "z1"), acct("mid", 500, "Z1")]
+        )
+        self.assertEqual([a.key for a in pending], ["big", "mid", "small", "unknown"])
+
+        pick = SM.batch_pick_next
+        self.assertEqual(pick(pending, [], max_per_source=None, max_per_destination=None).key, "big")
+        # z1 is at its cap (host names compare case-insensitively), so the next z2 account starts.
+        running = [pending[0]]
+        self.assertEqual(pick(pending[1:], running, max_per_source=1, max_per_destination=None).key, "unknown")
+        self.assertIsNone(pick(pending[1:], running, max_per_source=None, max_per_destination=1))
+        self.assertEqual(pick(pending[1:], running, max_per_source=2, max_per_destination=2).key, "mid")
+
+    def test_clone_journal(self) -> None:
+        account = {"srcHost": "z", "srcUser": "a@x", "dstHost": "d", "dstUser": "a@x"}
+        fp = SM.clone_step_fingerprint("imapsync", {"imapsyncArgs": ["--exclude", "Junk"]})
+        self.assertEqual(fp, SM.clone_step_fingerprint("imapsync", {"imapsyncArgs": ["--exclude", "Junk"]}))
+        self.assertNotEqual(fp, SM.clone_step_fingerprint("imapsync", {"imapsyncArgs": []}))
+        self.assertNotEqual(fp, SM.clone_step_fingerprint("clone-filters", {"imapsyncArgs": ["--exclude", "Junk"]}))
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = SM.clone_journal_path(pathlib.Path(tmp), src_host="z", src_user="a@x", dst_host="d", dst_user="a@x")
+            self.assertEqual(SM.load_clone_journal(path, account=account), {})
+            steps = {"imapsync": {"fingerprint": fp, "detail": "", "finishedAt": "t"}}
+            SM.save_clone_journal(path, account=account, steps=steps, complete=False)
+            self.assertEqual(SM.load_clone_journal(path, account=account), steps)
+            # Another account never picks up this journal, and a finished clone starts over.
+            self.assertEqual(SM.load_clone_journal(path, account=dict(account, dstUser="b@x")), {})
+            SM.save_clone_journal(path, account=account, steps=steps, complete=True)
+            self.assertEqual(SM.load_clone_journal(path, account=account), {})
+
+
+class TestCloneBatchRun(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dir = pathlib.Path(self.tmp.name)
+        self.children: list[list[str]] = []
+        self.saved_subprocess = SM.subprocess
+
+        def popen(argv, **kw):  # noqa: ANN001, ANN003, ANN202
+            self.children.append(argv)
+            return subprocess.Popen([sys.executable, "-c", STUB_CHILD, *argv[2:]], **kw)
+
+        SM.subprocess = types.SimpleNamespace(Popen=popen, DEVNULL=subprocess.DEVNULL, STDOUT=subprocess.STDOUT)
+
+    def tearDown(self) -> None:
+        SM.subprocess = self.saved_subprocess
+        self.tmp.cleanup()
+
+    def run_batch(self, accounts: str, status: dict, *extra: str):  # noqa: ANN201
+        (self.dir / "accounts.csv").write_text(accounts, encoding="utf-8")
+        work_dir = self.dir / "work"
+        work_dir.mkdir()
+        (work_dir / "status.json").write_text(json.dumps(status), encoding="utf-8")
+        args = SM.build_parser().parse_args(
+            [
+                "clone-batch",
+                "--accounts",
+                str(self.dir / "accounts.csv"),
+                "--work-dir",
+                str(work_dir),
+                "--src-host",
+                "zimbra.test",
+                "--dst-host",
+                "stalwart.test",
+                *extra,
+            ]
+        )
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            code = args.func(args)
+        saved = json.loads((work_dir / "status.json").read_text(encoding="utf-8"))
+        return code, saved["accounts"], out.getvalue()
+
+    def started(self) -> list[str]:
+        return sorted(argv[argv.index("--src-user") + 1] for argv in self.children)
+
+    def test_resume_skips_done_and_restarts_running(self) -> None:
+        status = {
+            "accounts": {
+                "done@x": {"status": "done", "attempts": 1, "exitCode": 0},
+                "stale@x": {"status": "running", "attempts": 1},
+            }
+        }
+        code, entries, out = self.run_batch(
+            "src_user\ndone@x\nstale@x\nnew@x\nbad@x\n", status, "--jobs", "2", "--max-per-source", "1"
+        )
+        self.assertEqual(code, 1)
+        self.assertEqual(self.started(), ["bad@x", "new@x", "stale@x"])
+        self.assertIn("4 account(s), 1 already done, 3 to run", out)
+        self.assertIn("clone-batch: 2 done, 1 failed, 0 interrupted, 0 not started", out)
+        self.assertEqual(entries["done@x"], {"status": "done", "attempts": 1, "exitCode": 0})
+        self.assertEqual((entries["stale@x"]["status"], entries["stale@x"]["attempts"]), ("done", 2))
+        self.assertEqual(entries["stale@x"]["steps"], [{"name": "imapsync", "user": "stale@x"}])
+        self.assertEqual((entries["new@x"]["status"], entries["new@x"]["attempts"]), ("done", 1))
+        self.assertEqual((entries["bad@x"]["status"], entries["bad@x"]["exitCode"]), ("failed", 3))
+
+    def test_all_done_exits_zero_without_children(self) -> None:
+        status = {"accounts": {"a@x": {"status": "done"}}}
+        code, entries, out = self.run_batch("src_user\na@x\n", status)
+        self.assertEqual(code, 0)
+        self.assertEqual(self.children, [])
+        self.assertIn("clone-batch: 0 done, 0 failed", out)
+
+    def test_host_caps_below_one_are_rejected(self) -> None:
+        parser = SM.build_parser()
+        for option in ("--max-per-source", "--max-per-destination"):
+            for value in ("0", "-2", "x"):
+                with self.assertRaises(SystemExit), contextlib.redirect_stderr(io.StringIO()):
+                    parser.parse_args(["clone-batch", "--accounts", "a.csv", option, value])
+        args = parser.parse_args(["clone-batch", "--accounts", "a.csv", "--max-per-source", "2"])
+        self.assertEqual(args.max_per_source, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
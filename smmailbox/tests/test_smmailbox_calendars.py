@@ -1,7 +1,11 @@
+import contextlib
 import importlib.machinery
 import importlib.util
+import io
 import pathlib
 import sys
+import tempfile
+import threading
 import unittest
 from datetime import datetime, timezone
 
@@ -131,6 +135,290 @@ class TestSmMailboxCalendars(unittest.TestCase):
         min_start_utc = datetime(2025, 1, 1, tzinfo=timezone.utc)
         self.assertFalse(SM.should_import_parsed_calendar_event(parsed, min_start_utc=min_start_utc))
 
+    def test_split_ics_chunks_keeps_overrides_and_timezones(self) -> None:
+        def vtimezone(tzid: str) -> str:
+            return f"BEGIN:VTIMEZONE\r\nTZID:{tzid}\r\nBEGIN:STANDARD\r\nTZOFFSETTO:+0100\r\nEND:STANDARD\r\nEND:VTIMEZONE\r\n"
+
+        def vevent(uid: str, extra: str = "", tzid: str = "Europe/Berlin") -> str:
+            return (
+                f"BEGIN:VEVENT\r\nUID:{uid}\r\n{extra}DTSTART;TZID={tzid}:20260101T100000\r\n"
+                "BEGIN:VALARM\r\nACTION:DISPLAY\r\nEND:VALARM\r\nEND:VEVENT\r\n"
+            )
+
+        ics = (
+            "BEGIN:VCALENDAR\r\nVERSION:2.0\r\nPRODID:Zimbra\r\n"
+            + vtimezone("Europe/Berlin")
+            + vtimezone("America/New_York")
+            + vevent("master", "RRULE:FREQ=WEEKLY\r\n")
+            + vevent("a")
+            + vevent("b", tzid="America/New_York")
+            # Folded UID line, and an override that is not next to its master.
+            + vevent("mas\r\n ter", "RECURRENCE-ID;TZID=Europe/Berlin:20260108T100000\r\n")
+            + vevent("c")
+            + "END:VCALENDAR\r\n"
+        ).encode()
+
+        chunks = list(SM.split_ics_chunks(ics, max_events=2, max_bytes=1_000_000))
+        self.assertEqual(len(chunks), 3)
+        for chunk in chunks:
+            self.assertTrue(chunk.startswith(b"BEGIN:VCALENDAR\r\nVERSION:2.0\r\nPRODID:Zimbra\r\n"))
+            self.assertTrue(chunk.endswith(b"END:VEVENT\r\nEND:VCALENDAR\r\n"))
+            self.assertEqual(chunk.count(b"BEGIN:VEVENT"), chunk.count(b"END:VEVENT"))
+        # The master travels with its override; New York is only sent where it is used.
+        self.assertIn(b"RRULE", chunks[0])
+        self.assertIn(b"RECURRENCE-ID", chunks[0])
+        self.assertNotIn(b"America/New_York", chunks[0])
+        self.assertIn(b"TZID:America/New_York", chunks[1])
+        self.assertEqual(sum(c.count(b"BEGIN:VEVENT") for c in chunks), 5)
+
+        # A byte budget splits further but never separates a UID group.
+        small = list(SM.split_ics_chunks(ics, max_events=100, max_bytes=len(chunks[0]) - 1))
+        self.assertEqual([c.count(b"BEGIN:VEVENT") for c in small], [2, 1, 1, 1])
+
+        self.assertEqual(list(SM.split_ics_chunks(b"BEGIN:VCALENDAR\r\nEND:VCALENDAR\r\n", max_events=5, max_bytes=99)), [])
+
+    def test_local_ics_conversion(self) -> None:
+        ics = (
+            "BEGIN:VCALENDAR\r\nPRODID:Zimbra-Calendar-Provider\r\nVERSION:2.0\r\n"
+            "BEGIN:VTIMEZONE\r\nTZID:(GMT-05.00) Eastern Time\r\nBEGIN:STANDARD\r\nTZOFFSETTO:-0500\r\n"
+            "END:STANDARD\r\nEND:VTIMEZONE\r\n"
+            "BEGIN:VEVENT\r\nUID:weekly-1\r\nSUMMARY:Team sync\\, weekly\r\nLOCATION:Room 1\r\n"
+            "ORGANIZER;CN=Alice:mailto:alice@example.com\r\n"
+            "ATTENDEE;CN=Bob;ROLE=OPT-PARTICIPANT;PARTSTAT=ACCEPTED;RSVP=TRUE:mailto:bob@exa\r\n mple.com\r\n"
+            "RRULE:FREQ=WEEKLY;INTERVAL=2;BYDAY=MO,-1FR;UNTIL=20261231T150000Z\r\n"
+            "EXDATE;TZID=America/New_York:20260112T100000\r\n"
+            "DTSTART;TZID=America/New_York:20260105T100000\r\nDTEND;TZID=America/New_York:20260105T103000\r\n"
+            "BEGIN:VALARM\r\nACTION:DISPLAY\r\nUID:alarm\r\nEND:VALARM\r\nEND:VEVENT\r\n"
+            "BEGIN:VEVENT\r\nUID:allday\r\nSUMMARY:Holiday\r\nDTSTART;VALUE=DATE:20260704\r\n"
+            "DTEND;VALUE=DATE:20260707\r\nEND:VEVENT\r\n"
+            "BEGIN:VEVENT\r\nUID:dst\r\nDTSTART;TZID=America/New_York:20240310T010000\r\n"
+            "DTEND;TZID=America/New_York:20240310T030000\r\nEND:VEVENT\r\n"
+            "BEGIN:VEVENT\r\nUID:weekly-1\r\nRECURRENCE-ID:20260119T150000Z\r\nSUMMARY:Moved\r\nLOCATION:Room 1\r\n"
+            "ORGANIZER;CN=Alice:mailto:alice@example.com\r\n"
+            "ATTENDEE;CN=Bob;ROLE=OPT-PARTICIPANT;PARTSTAT=ACCEPTED;RSVP=TRUE:mailto:bob@example.com\r\n"
+            "DTSTART;TZID=America/New_York:20260119T140000\r\nDTEND;TZID=America/New_York:20260119T143000\r\n"
+            "END:VEVENT\r\n"
+            'BEGIN:VEVENT\r\nUID:custom-tz\r\nDTSTART;TZID="(GMT-05.00) Eastern Time":20260105T100000\r\n'
+            "DURATION:PT1H\r\nEND:VEVENT\r\nEND:VCALENDAR\r\n"
+        ).encode()
+
+        events, residual = SM.ics_to_jscalendar_events(ics)
+        weekly, allday, dst = events
+        self.assertEqual(
+            {k: weekly[k] for k in ("start", "timeZone", "duration", "title", "organizerCalendarAddress")},
+            {
+                "start": "2026-01-05T10:00:00",
+                "timeZone": "America/New_York",
+                "duration": "PT30M",
+                "title": "Team sync, weekly",
+                "organizerCalendarAddress": "mailto:alice@example.com",
+            },
+        )
+        self.assertEqual(weekly["locations"], {"1": {"@type": "Location", "name": "Room 1"}})
+        bob = [p for p in weekly["participants"].values() if p["calendarAddress"] == "mailto:bob@example.com"]
+        self.assertEqual(bob[0]["roles"], {"attendee": True, "optional": True})
+        self.assertEqual(bob[0]["participationStatus"], "accepted")
+        self.assertEqual(
+            weekly["recurrenceRule"],
+            {
+                "@type": "RecurrenceRule",
+                "frequency": "weekly",
+                "interval": 2,
+                "byDay": [{"@type": "NDay", "day": "mo"}, {"@type": "NDay", "day": "fr", "nthOfPeriod": -1}],
+                "until": "2026-12-31T10:00:00",
+            },
+        )
+        # EXDATE becomes an excluded override; the RECURRENCE-ID (given in UTC) is keyed in the
+        # master's time zone and only carries what differs from the master.
+        self.assertEqual(
+            weekly["recurrenceOverrides"],
+            {
+                "2026-01-12T10:00:00": {"excluded": True},
+                "2026-01-19T10:00:00": {"start": "2026-01-19T14:00:00", "title": "Moved"},
+            },
+        )
+        self.assertEqual(
+            {k: allday[k] for k in ("start", "duration", "showWithoutTime")},
+            {"start": "2026-07-04T00:00:00", "duration": "P3D", "showWithoutTime": True},
+        )
+        # 01:00-03:00 on the night clocks spring forward is one hour long, not two.
+        self.assertEqual((dst["start"], dst["duration"]), ("2024-03-10T01:00:00", "PT1H"))
+        create = SM.jmap_calendar_event_create_from_parsed(allday, calendar_id="cal1", stable_uid="allday")
+        self.assertEqual(create["timeZone"], "Etc/UTC")
+
+        # A TZID only its VTIMEZONE can explain is left to the server, with the calendar's timezones.
+        self.assertIsNotNone(residual)
+        self.assertIn(b"UID:custom-tz", residual)
+        self.assertIn(b"TZID:(GMT-05.00) Eastern Time", residual)
+        self.assertNotIn(b"UID:allday", residual)
+        self.assertTrue(residual.startswith(b"BEGIN:VCALENDAR\r\nPRODID:Zimbra-Calendar-Provider\r\n"))
+
+    def test_local_ics_leaves_unsupported_rules_to_server(self) -> None:
+        def one(extra: str) -> tuple[list, object]:
+            ics = f"BEGIN:VCALENDAR\r\nBEGIN:VEVENT\r\nUID:u\r\nDTSTART:20260105T100000Z\r\n{extra}END:VEVENT\r\nEND:VCALENDAR\r\n"
+            return SM.ics_to_jscalendar_events(ics.encode())
+
+        self.assertEqual(len(one("RRULE:FREQ=MONTHLY;BYMONTHDAY=-1\r\n")[0]), 1)
+        for extra in ("RRULE:RSCALE=HEBREW;FREQ=YEARLY\r\n", "RDATE;VALUE=PERIOD:20260106T100000Z/PT1H\r\n", "EXRULE:FREQ=DAILY\r\n"):
+            events, residual = one(extra)
+            self.assertEqual(events, [], extra)
+            self.assertIsNotNone(residual, extra)
+
+    def test_rest_export_ics_window(self) -> None:
+        urls: list[str] = []
+        orig = SM.http_get_bytes
+        SM.http_get_bytes = lambda url, **_kw: urls.append(url) or b""  # type: ignore[assignment]
+        try:
+            common = dict(zimbra_host="z.test", zimbra_user="a@b.test", abs_folder_path="/Calendar/Work", auth_token="t")
+            SM.zimbra_rest_export_ics(verify_tls=True, **common)
+            SM.zimbra_rest_export_ics(
+                verify_tls=True,
+                start=datetime(2025, 1, 1, tzinfo=timezone.utc),
+                end=datetime(2026, 1, 1, tzinfo=timezone.utc),
+                **common,
+            )
+        finally:
+            SM.http_get_bytes = orig  # type: ignore[assignment]
+        self.assertEqual(urls[0], "https://z.test/home/a%40b.test/Calendar/Work?fmt=ics")
+        self.assertEqual(urls[1], urls[0] + "&start=1735689600000&end=1767225600000")
+
+
+def vevent(uid: str, summary: str) -> str:
+    return f"BEGIN:VEVENT\r\nUID:{uid}\r\nSUMMARY:{summary}\r\nDTSTART:20300105T100000Z\r\nDURATION:PT1H\r\nEND:VEVENT\r\n"
+
+
+class TestCloneCalendarsConcurrency(unittest.TestCase):
+    """cmd_clone_calendars against an in-memory Zimbra export and CalendarEvent/set."""
+
+    FOLDERS = [
+        SM.ZimbraCalendarFolder(folder_id="11", name="A", abs_folder_path="/Calendar/A"),
+        SM.ZimbraCalendarFolder(folder_id="12", name="B", abs_folder_path="/Calendar/B"),
+        SM.ZimbraCalendarFolder(folder_id="13", name="C", abs_folder_path="/Calendar/C"),
+    ]
+
+    def setUp(self) -> None:
+        self.tmp = tempfile.TemporaryDirectory()
+        self.exports: dict[str, str] = {}
+        self.export_hooks: dict[str, object] = {}
+        self.exported: list[str] = []
+        self.set_calls: list[tuple[dict, dict]] = []
+        self.written: dict[str, threading.Event] = {f.abs_folder_path: threading.Event() for f in self.FOLDERS}
+        self.lock = threading.Lock()
+        self.next_id = 0
+
+        def export_ics(*, abs_folder_path, **_kw):  # noqa: ANN001, ANN003
+            with self.lock:
+                self.exported.append(abs_folder_path)
+            hook = self.export_hooks.get(abs_folder_path)
+            if hook is not None:
+                hook()  # type: ignore[operator]
+            events = self.exports.get(abs_folder_path)
+            return f"BEGIN:VCALENDAR\r\n{events}END:VCALENDAR\r\n".encode() if events else b""
+
+        def event_set(*, create, update, **_kw):  # noqa: ANN001, ANN003
+            created = {}
+            with self.lock:
+                self.set_calls.append((dict(create), dict(update)))
+                for key in create:
+                    self.next_id += 1
+                    created[key] = {"id": f"ev{self.next_id}"}
+            for obj in list(create.values()) + list(update.values()):
+                self.written[self.cal_to_folder[next(iter(obj["calendarIds"]))]].set()
+            return {"created": created}
+
+        self.cal_to_folder = {f"cal-{f.name}": f.abs_folder_path for f in self.FOLDERS}
+        session = SM.StalwartJmapSessionInfo(
+            api_url="https://s.test/jmap", api_host="s.test", mail_account_id="acct",
+            sieve_account_id=None, contacts_account_id=None,
+        )
+        fakes = {
+            "stalwart_jmap_session_info": lambda **_kw: session,
+            "jmap_calendar_get_all": lambda **_kw: [{"id": f"cal-{f.name}", "name": f.name} for f in self.FOLDERS],
+            "jmap_load_uid_index": lambda **_kw: ({}, None),
+            "zimbra_rest_export_ics": export_ics,
+            "jmap_calendar_event_set": event_set,
+        }
+        self.originals = {name: getattr(SM, name) for name in fakes}
+        for name, fake in fakes.items():
+            setattr(SM, name, fake)
+
+    def tearDown(self) -> None:
+        for name, orig in self.originals.items():
+            setattr(SM, name, orig)
+        self.tmp.cleanup()
+
+    def run_clone(self, folders: list, *, workers: int = 2) -> str:
+        args = SM.build_parser().parse_args(
+            [
+                "clone-calendars", "--zimbra-host", "z.test", "--zimbra-user", "a@x", "--zimbra-password", "zp",
+                "--dst-host", "s.test", "--dst-user", "a@x", "--dst-password", "dp",
+                "--state-dir", self.tmp.name, "--calendar-workers", str(workers),
+            ]
+        )
+        args.zimbra_auth_token = "token"
+        args.zimbra_calendar_folders = folders
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            SM.cmd_clone_calendars(args)
+        return out.getvalue()
+
+    def shared_uid_run(self, *, first: str, second: str) -> tuple[str, list[tuple[dict, dict]]]:
+        a, b = self.FOLDERS[:2]
+        self.exports = {a.abs_folder_path: vevent("shared", "from A"), b.abs_folder_path: vevent("shared", "from B")}
+        # `second` only exports once `first` has written its events.
+        self.export_hooks = {second: lambda: self.assertTrue(self.written[first].wait(5))}
+        output = self.run_clone([a, b])
+        return output, self.set_calls
+
+    def test_shared_uid_lower_folder_first_is_updated_from_higher(self) -> None:
+        output, calls = self.shared_uid_run(first="/Calendar/A", second="/Calendar/B")
+        creates = [obj for create, _ in calls for obj in create.values()]
+        updates = [obj for _, update in calls for obj in update.values()]
+        self.assertEqual([obj["title"] for obj in creates], ["from A"])
+        self.assertEqual([(obj["title"], obj["calendarIds"]) for obj in updates], [("from B", {"cal-B": True})])
+        self.assertIn("1 create, 1 update", output)
+        self.assertIn("Kept the last folder's copy of 1 event(s)", output)
+
+    def test_shared_uid_higher_folder_first_is_created_once(self) -> None:
+        output, calls = self.shared_uid_run(first="/Calendar/B", second="/Calendar/A")
+        creates = [obj for create, _ in calls for obj in create.values()]
+        self.assertEqual([(obj["title"], obj["calendarIds"]) for obj in creates], [("from B", {"cal-B": True})])
+        self.assertEqual([update for _, update in calls if update], [])
+        self.assertIn("1 create, 0 update", output)
+        self.assertIn("Kept the last folder's copy of 1 event(s)", output)
+
+    def test_per_folder_timing_rows(self) -> None:
+        self.exports = {
+            "/Calendar/A": vevent("a1", "one") + vevent("a2", "two"),
+            "/Calendar/B": vevent("b1", "three"),
+        }
+        output = self.run_clone(self.FOLDERS)
+        self.assertIn("Per-folder timing (2 folder worker(s)", output)
+        self.assertRegex(output, r"\n  /Calendar/A: 2 event\(s\) in [0-9.]+s \(export [0-9.]+s, parse [0-9.]+s, write [0-9.]+s\)")
+        self.assertRegex(output, r"\n  /Calendar/B: 1 event\(s\) in ")
+        # An empty export produces no timing row.
+        self.assertNotIn("/Calendar/C:", output)
+
+    def test_failing_folder_stops_the_others(self) -> None:
+        failed = threading.Event()
+
+        def fail() -> None:
+            failed.set()
+            raise SystemExit("export failed\n")
+
+        def slow() -> None:
+            # Still exporting when folder A fails; its events must not be written.
+            failed.wait(5)
+            threading.Event().wait(0.3)
+
+        self.exports = {"/Calendar/B": vevent("b1", "late"), "/Calendar/C": vevent("c1", "never")}
+        self.export_hooks = {"/Calendar/A": fail, "/Calendar/B": slow}
+        with self.assertRaisesRegex(SystemExit, "export failed"):
+            self.run_clone(self.FOLDERS)
+        self.assertEqual(self.set_calls, [])
+        # Folder C was still queued behind the two workers and never starts.
+        self.assertNotIn("/Calendar/C", self.exported)
+
 
 if __name__ == "__main__":
     unittest.main()
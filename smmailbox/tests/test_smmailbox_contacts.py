@@ -2,6 +2,7 @@ import importlib.machinery
 import importlib.util
 import pathlib
 import sys
+import time
 import unittest
 
 
@@ -134,6 +135,39 @@ class TestSmMailboxContacts(unittest.TestCase):
         self.assertEqual(card.get("kind"), "group")
         self.assertEqual(card.get("members"), {'"user" <user@example.com>': True, "user@example.com": True})
 
+    def test_ordered_pipeline_keeps_task_order(self) -> None:
+        def task(i: int):
+            def run() -> int:
+                time.sleep(0.02 if i % 3 == 0 else 0.001)
+                return i
+
+            return run
+
+        seen: list[int] = []
+        SM.ordered_pipeline((task(i) for i in range(20)), lambda i: seen.append(i) is None, workers=4, depth=3)
+        self.assertEqual(seen, list(range(20)))
+
+        # consume() returning False stops the producer; nothing after the stop point is consumed.
+        produced: list[int] = []
+
+        def tasks():
+            for i in range(100):
+                produced.append(i)
+                yield task(i)
+
+        seen = []
+        SM.ordered_pipeline(tasks(), lambda i: seen.append(i) is None and i < 4, workers=2, depth=2)
+        self.assertEqual(seen, [0, 1, 2, 3, 4])
+        self.assertLess(len(produced), 100)
+
+    def test_ordered_pipeline_reraises_task_errors(self) -> None:
+        def boom() -> int:
+            raise SystemExit("HTTP 500 from zimbra\n")
+
+        with self.assertRaises(SystemExit) as ctx:
+            SM.ordered_pipeline(iter([lambda: 1, boom, lambda: 3]), lambda _i: True, workers=2, depth=1)
+        self.assertIn("HTTP 500", str(ctx.exception))
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,154 @@
+import http.server
+import importlib.machinery
+import importlib.util
+import json
+import pathlib
+import sys
+import threading
+import time
+import unittest
+
+
+def load_smmailbox_module():
+    smmailbox_path = pathlib.Path(__file__).resolve().parents[1] / "smmailbox"
+    loader = importlib.machinery.SourceFileLoader("smmailbox", str(smmailbox_path))
+    spec = importlib.util.spec_from_loader(loader.name, loader)
+    assert spec and spec.loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[loader.name] = module
+    spec.loader.exec_module(module)  # type: ignore[attr-defined]
+    return module
+
+
+SM = load_smmailbox_module()
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *_args) -> None:  # noqa: D401
+        return
+
+    def _send(self, status: int, body: bytes, *, extra: dict[str, str] | None = None) -> None:
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        for k, v in (extra or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self) -> None:  # noqa: N802
+        if self.path == "/redirect":
+            self._send(302, b"", extra={"Location": "/json"})
+        elif self.path == "/json":
+            self._send(200, b'{"ok": true}')
+        elif self.path == "/drop":
+            # Answer, then drop the connection without announcing "Connection: close".
+            self._send(200, b"dropped")
+            self.close_connection = True
+        else:
+            self._send(200, b"bytes:" + self.path.encode())
+
+    def do_POST(self) -> None:  # noqa: N802
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length)
+        self.server.posts.append(self.path)  # type: ignore[attr-defined]
+        if self.path == "/hangup":
+            # Take the whole request, then drop the connection without answering.
+            self.close_connection = True
+        elif self.path == "/fail":
+            self._send(500, b"boom")
+        elif self.headers.get("Content-Type", "").startswith("application/json"):
+            self._send(200, json.dumps({"echo": json.loads(body)}).encode())
+        else:
+            self._send(200, body)
+
+
+class TestSmMailboxHttpPool(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+        cls.server.daemon_threads = True
+        cls.server.posts = []  # type: ignore[attr-defined]
+        cls.thread = threading.Thread(target=cls.server.serve_forever, daemon=True)
+        cls.thread.start()
+        cls.base = f"http://127.0.0.1:{cls.server.server_address[1]}"
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self) -> None:
+        self.orig_pool = SM.HTTP_POOL
+        self.orig_uses_proxy = SM.http_uses_proxy
+        SM.HTTP_POOL = SM.HttpConnectionPool()
+        SM.http_uses_proxy = lambda _url: False  # type: ignore[assignment]
+
+    def tearDown(self) -> None:
+        SM.HTTP_POOL.close_all()
+        SM.HTTP_POOL = self.orig_pool
+        SM.http_uses_proxy = self.orig_uses_proxy  # type: ignore[assignment]
+
+    def test_requests_share_one_keep_alive_connection(self) -> None:
+        self.assertEqual(
+            SM.http_post_json(f"{self.base}/api", {"a": 1}, headers={}, verify_tls=True),
+            {"echo": {"a": 1}},
+        )
+        self.assertEqual(SM.http_get_json(f"{self.base}/json", headers={}, verify_tls=True), {"ok": True})
+        self.assertEqual(SM.http_get_bytes(f"{self.base}/x?fmt=ics", headers={}, verify_tls=True), b"bytes:/x?fmt=ics")
+        self.assertEqual(SM.http_post_xml(f"{self.base}/soap", b"<x/>", verify_tls=True), b"<x/>")
+
+        self.assertEqual(SM.HTTP_POOL.requests, 4)
+        self.assertEqual(SM.HTTP_POOL.connections_opened, 1)
+        self.assertEqual(SM.HTTP_POOL.connections_reused, 3)
+
+    def test_http_error_raises_system_exit_with_body(self) -> None:
+        with self.assertRaises(SystemExit) as ctx:
+            SM.http_post_xml(f"{self.base}/fail", b"<x/>", verify_tls=True)
+        self.assertIn("HTTP 500", str(ctx.exception))
+        self.assertIn("boom", str(ctx.exception))
+
+    def test_redirect_is_followed(self) -> None:
+        self.assertEqual(SM.http_get_json(f"{self.base}/redirect", headers={}, verify_tls=True), {"ok": True})
+
+    def test_stale_pooled_connection_is_retried(self) -> None:
+        # Simulate the server closing the connection just after the pre-use check passed.
+        SM.HTTP_POOL._reusable = lambda _conn, _idle_since: True  # type: ignore[method-assign]
+        self.assertEqual(SM.http_get_bytes(f"{self.base}/drop", headers={}, verify_tls=True), b"dropped")
+        self.assertEqual(SM.http_get_json(f"{self.base}/json", headers={}, verify_tls=True), {"ok": True})
+        self.assertEqual(SM.HTTP_POOL.stale_retries, 1)
+        self.assertEqual(SM.HTTP_POOL.connections_opened, 2)
+
+    def test_post_after_server_closed_idle_connection_uses_fresh_one(self) -> None:
+        self.assertEqual(SM.http_get_bytes(f"{self.base}/drop", headers={}, verify_tls=True), b"dropped")
+        time.sleep(0.1)  # let the server's FIN reach the idle pooled socket
+        self.assertEqual(SM.http_post_xml(f"{self.base}/soap", b"<x/>", verify_tls=True), b"<x/>")
+        self.assertEqual(
+            (SM.HTTP_POOL.connections_opened, SM.HTTP_POOL.connections_expired, SM.HTTP_POOL.stale_retries),
+            (2, 1, 0),
+        )
+
+    def test_idle_connection_older_than_ttl_is_not_reused(self) -> None:
+        SM.HTTP_POOL.idle_ttl = 0
+        self.assertEqual(SM.http_post_xml(f"{self.base}/soap", b"<a/>", verify_tls=True), b"<a/>")
+        self.assertEqual(SM.http_post_xml(f"{self.base}/soap", b"<b/>", verify_tls=True), b"<b/>")
+        self.assertEqual((SM.HTTP_POOL.connections_opened, SM.HTTP_POOL.connections_reused), (2, 0))
+
+    def test_dropped_post_is_not_resent(self) -> None:
+        self.assertEqual(SM.http_post_xml(f"{self.base}/soap", b"<x/>", verify_tls=True), b"<x/>")
+        self.server.posts.clear()  # type: ignore[attr-defined]
+        # The reused connection delivers the POST, then the server hangs up. It may have
+        # acted on the request, so the pool reports the failure instead of replaying it.
+        with self.assertRaises(SM.HTTP_STALE_CONNECTION_ERRORS):
+            SM.HTTP_POOL.request("POST", f"{self.base}/hangup", body=b"<x/>", headers={}, verify_tls=True)
+        self.assertEqual(self.server.posts, ["/hangup"])  # type: ignore[attr-defined]
+        self.assertEqual(SM.HTTP_POOL.stale_retries, 0)
+
+    def test_ssl_context_is_cached(self) -> None:
+        self.assertIs(SM.build_ssl_context(verify=True), SM.build_ssl_context(verify=True))
+        self.assertIsNot(SM.build_ssl_context(verify=True), SM.build_ssl_context(verify=False))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,225 @@
+import importlib.machinery
+import importlib.util
+import pathlib
+import sys
+import tempfile
+import unittest
+
+
+def load_smmailbox_module():
+    smmailbox_path = pathlib.Path(__file__).resolve().parents[1] / "smmailbox"
+    loader = importlib.machinery.SourceFileLoader("smmailbox", str(smmailbox_path))
+    spec = importlib.util.spec_from_loader(loader.name, loader)
+    assert spec and spec.loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[loader.name] = module
+    spec.loader.exec_module(module)  # type: ignore[attr-defined]
+    return module
+
+
+SM = load_smmailbox_module()
+
+
+class FakeJmapServer:
+    """Answers */query and */get (with #ids back-references) over an in-memory object list."""
+
+    def __init__(self, objects: list[dict], *, max_limit: int = 1000) -> None:
+        self.objects = objects
+        self.max_limit = max_limit
+        self.requests: list[dict] = []
+        self.state = 0
+        self.oldest_state = 0
+        self.log: list[tuple[int, str, str]] = []  # (state, "created"/"updated"/"destroyed", id)
+
+    def change(self, kind: str, obj: dict) -> None:
+        self.state += 1
+        self.log.append((self.state, kind, obj["id"]))
+        if kind == "created":
+            self.objects.append(obj)
+        elif kind == "destroyed":
+            self.objects = [o for o in self.objects if o["id"] != obj["id"]]
+
+    def __call__(self, *, api_url, username, password, request, verify_tls):  # noqa: ANN001
+        self.requests.append(request)
+        results: dict[str, dict] = {}
+        responses = []
+        for name, args, call_id in request["methodCalls"]:
+            if name.endswith("/query"):
+                limit = min(args["limit"], self.max_limit)
+                ids = [o["id"] for o in self.objects[args["position"] : args["position"] + limit]]
+                payload = {"ids": ids, "position": args["position"], "limit": limit}
+                if args.get("calculateTotal"):
+                    payload["total"] = len(self.objects)
+            elif name.endswith("/get"):
+                if "#ids" in args:
+                    ref = args["#ids"]
+                    ids = results[ref["resultOf"]]["ids"]
+                else:
+                    ids = args["ids"]
+                by_id = {o["id"]: o for o in self.objects}
+                payload = {"list": [by_id[i] for i in ids if i in by_id], "state": str(self.state)}
+            elif name.endswith("/changes"):
+                since = int(args["sinceState"])
+                if since < self.oldest_state:
+                    responses.append(["error", {"type": "cannotCalculateChanges"}, call_id])
+                    continue
+                entries = [e for e in self.log if e[0] > since][: args["maxChanges"]]
+                payload = {
+                    "oldState": str(since),
+                    "newState": str(entries[-1][0] if entries else since),
+                    "hasMoreChanges": bool(entries) and entries[-1][0] < self.state,
+                    "created": [i for _s, k, i in entries if k == "created"],
+                    "updated": [i for _s, k, i in entries if k == "updated"],
+                    "destroyed": [i for _s, k, i in entries if k == "destroyed"],
+                }
+            else:
+                raise AssertionError(name)
+            results[call_id] = payload
+            responses.append([name, payload, call_id])
+        return {"methodResponses": responses}
+
+
+class TestSmMailboxJmap(unittest.TestCase):
+    def setUp(self) -> None:
+        self.orig_jmap_call = SM.jmap_call
+
+    def tearDown(self) -> None:
+        SM.jmap_call = self.orig_jmap_call  # type: ignore[assignment]
+
+    def uid_index(self, server: FakeJmapServer, *, page_size: int, max_calls: int) -> dict[str, str]:
+        SM.jmap_call = server  # type: ignore[assignment]
+        index, _state = SM.jmap_uid_index(
+            api_url="https://jmap.test/api",
+            username="u",
+            password="p",
+            account_id="a",
+            capability="urn:ietf:params:jmap:contacts",
+            type_name="ContactCard",
+            filter_obj=None,
+            page_size=page_size,
+            max_calls_in_request=max_calls,
+            verify_tls=True,
+        )
+        return index
+
+    def test_uid_index_packs_query_and_get_pages(self) -> None:
+        objects = [{"id": f"c{i}", "uid": f"u{i}"} for i in range(25)] + [{"id": "c25", "uid": "u0"}]
+        server = FakeJmapServer(objects)
+        index = self.uid_index(server, page_size=5, max_calls=8)
+
+        self.assertEqual(len(index), 25)
+        self.assertEqual(index["u0"], "c0")  # first seen wins
+        # 26 objects / 5 per page = 6 pages, 4 query+get pairs per request -> 2 round trips.
+        self.assertEqual(len(server.requests), 2)
+        first_calls = server.requests[0]["methodCalls"]
+        self.assertEqual(len(first_calls), 8)
+        self.assertEqual(first_calls[1][1]["#ids"], {"resultOf": "q0", "name": "ContactCard/query", "path": "/ids"})
+        # The second request only asks for the pages that remain.
+        self.assertEqual([c[1]["position"] for c in server.requests[1]["methodCalls"][::2]], [20, 25])
+
+    def test_uid_index_follows_server_capped_limit(self) -> None:
+        objects = [{"id": f"c{i}", "uid": f"u{i}"} for i in range(12)]
+        index = self.uid_index(FakeJmapServer(objects, max_limit=4), page_size=10, max_calls=4)
+        self.assertEqual(sorted(index.values()), sorted(o["id"] for o in objects))
+
+    def test_uid_index_empty(self) -> None:
+        server = FakeJmapServer([])
+        self.assertEqual(self.uid_index(server, page_size=5, max_calls=16), {})
+        self.assertEqual(len(server.requests), 1)
+
+
+    def load_cached(self, server: FakeJmapServer, cache: pathlib.Path) -> tuple[dict[str, str], object]:
+        SM.jmap_call = server  # type: ignore[assignment]
+        return SM.jmap_load_uid_index(
+            api_url="https://jmap.test/api",
+            username="u",
+            password="p",
+            account_id="a",
+            capability="urn:ietf:params:jmap:calendars",
+            type_name="CalendarEvent",
+            filter_obj={},
+            page_size=2,
+            max_calls_in_request=16,
+            cache_path=cache,
+            verify_tls=True,
+        )
+
+    def test_cached_index_is_refreshed_via_changes(self) -> None:
+        server = FakeJmapServer([{"id": f"e{i}", "uid": f"u{i}"} for i in range(6)])
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = SM.uid_index_cache_path(
+                pathlib.Path(tmp), api_url="https://jmap.test/api", account_id="a", type_name="CalendarEvent"
+            )
+            index, state = self.load_cached(server, cache)
+            self.assertEqual(len(index), 6)
+            # This run creates e6 itself and records it, as flush() does.
+            server.change("created", {"id": "e6", "uid": "u6"})
+            index["u6"] = "e6"
+            SM.save_uid_index_cache(
+                cache, api_url="https://jmap.test/api", account_id="a", type_name="CalendarEvent", index=index, state=state
+            )
+
+            # Between runs: someone else creates e7, destroys e0 and updates e1.
+            server.change("created", {"id": "e7", "uid": "u7"})
+            server.change("destroyed", {"id": "e0"})
+            server.change("updated", {"id": "e1"})
+            server.requests.clear()
+            index, state = self.load_cached(server, cache)
+
+            self.assertEqual(index, {f"u{i}": f"e{i}" for i in range(1, 8)})
+            self.assertEqual(state, str(server.state))
+            methods = [call[0] for req in server.requests for call in req["methodCalls"]]
+            # Two /changes pages (maxChanges=2), and a /get only for the one id the index did not know.
+            self.assertEqual(methods, ["CalendarEvent/changes", "CalendarEvent/get", "CalendarEvent/changes"])
+            self.assertEqual(server.requests[1]["methodCalls"][0][1]["ids"], ["e7"])
+
+            # State too old for the server: fall back to a full rebuild.
+            server.oldest_state = server.state + 1
+            SM.save_uid_index_cache(
+                cache, api_url="https://jmap.test/api", account_id="a", type_name="CalendarEvent", index={}, state="0"
+            )
+            index, _state = self.load_cached(server, cache)
+            self.assertEqual(len(index), 7)
+
+    def test_set_ops_split_by_count_and_size(self) -> None:
+        create = {f"k{i}": {"uid": f"u{i}", "notes": "x" * 1000} for i in range(5)}
+        update = {"c1": {"notes": "y"}, "c2": {"notes": "z" * 9000}}
+
+        parts = SM.jmap_split_set_ops(create, update, max_objects=3, max_bytes=10_000_000)
+        self.assertEqual([(len(c), len(u)) for c, u in parts], [(3, 0), (2, 1), (0, 1)])
+
+        # ~1 KiB per create, 4 KiB of the budget held back for the envelope: 3 creates per part,
+        # and the 9 KiB update travels alone rather than being dropped.
+        parts = SM.jmap_split_set_ops(create, update, max_objects=500, max_bytes=7200)
+        self.assertEqual([(len(c), len(u)) for c, u in parts], [(3, 0), (2, 1), (0, 1)])
+        merged_create = {k: v for c, _u in parts for k, v in c.items()}
+        merged_update = {k: v for _c, u in parts for k, v in u.items()}
+        self.assertEqual((merged_create, merged_update), (create, update))
+
+        self.assertEqual(SM.jmap_split_set_ops({}, {}, max_objects=10, max_bytes=100), [])
+
+    def test_content_hash_ledger(self) -> None:
+        a = SM.jmap_object_fingerprint({"uid": "u1", "name": {"full": "A"}, "emails": None})
+        self.assertEqual(a, SM.jmap_object_fingerprint({"emails": None, "name": {"full": "A"}, "uid": "u1"}))
+        self.assertNotEqual(a, SM.jmap_object_fingerprint({"uid": "u1", "name": {"full": "B"}, "emails": None}))
+
+        with tempfile.TemporaryDirectory() as tmp:
+            key = {"api_url": "https://jmap.test/api", "account_id": "a", "type_name": "ContactCard"}
+            path = SM.content_hash_path(pathlib.Path(tmp), **key)
+            self.assertEqual(SM.load_content_hashes(path, **key), {})
+            SM.save_content_hashes(path, hashes={"u1": a}, **key)
+            self.assertEqual(SM.load_content_hashes(path, **key), {"u1": a})
+            # A ledger for another account/server is never applied.
+            self.assertEqual(SM.load_content_hashes(path, **dict(key, account_id="b")), {})
+
+    def test_session_limits(self) -> None:
+        session = {"capabilities": {"urn:ietf:params:jmap:core": {"maxObjectsInSet": 250, "maxSizeRequest": True}}}
+        self.assertEqual(SM.jmap_core_capability_int(session, "maxObjectsInSet", 500), 250)
+        self.assertEqual(SM.jmap_core_capability_int(session, "maxSizeRequest", 10_000_000), 10_000_000)
+        self.assertEqual(SM.jmap_session_limit(None, server_max=250, what="--jmap-batch-size"), 250)
+        self.assertEqual(SM.jmap_session_limit(100, server_max=250, what="--jmap-batch-size"), 100)
+        self.assertEqual(SM.jmap_session_limit(1000, server_max=250, what="--jmap-batch-size"), 250)
+
+
+if __name__ == "__main__":
+    unittest.main()
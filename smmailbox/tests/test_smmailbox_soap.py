@@ -0,0 +1,296 @@
+import importlib.machinery
+import importlib.util
+import json
+import pathlib
+import sys
+import unittest
+
+
+def load_smmailbox_module():
+    smmailbox_path = pathlib.Path(__file__).resolve().parents[1] / "smmailbox"
+    loader = importlib.machinery.SourceFileLoader("smmailbox", str(smmailbox_path))
+    spec = importlib.util.spec_from_loader(loader.name, loader)
+    assert spec and spec.loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[loader.name] = module
+    spec.loader.exec_module(module)  # type: ignore[attr-defined]
+    return module
+
+
+SM = load_smmailbox_module()
+
+SOAP_URL = "https://example.test/service/soap"
+
+
+class TestSmMailboxSoapJson(unittest.TestCase):
+    def setUp(self) -> None:
+        self.orig_http_request = SM.http_request
+        self.orig_http_post_xml = SM.http_post_xml
+        SM.ZIMBRA_SOAP_JSON_FALLBACK.clear()
+        self.json_requests: list[dict] = []
+        self.json_response: bytes = b""
+
+        def fake_http_request(method, url, *, data=None, headers, verify_tls):  # noqa: ANN001
+            self.json_requests.append(json.loads(data))
+            return self.json_response
+
+        SM.http_request = fake_http_request  # type: ignore[assignment]
+
+    def tearDown(self) -> None:
+        SM.http_request = self.orig_http_request  # type: ignore[assignment]
+        SM.http_post_xml = self.orig_http_post_xml  # type: ignore[assignment]
+        SM.ZIMBRA_SOAP_JSON_FALLBACK.clear()
+
+    def respond(self, name: str, body: dict) -> None:
+        self.json_response = json.dumps({"Header": {}, "Body": {name: body}}).encode()
+
+    def test_request_envelope(self) -> None:
+        self.respond("GetContactsResponse", {"_jsns": "urn:zimbraMail"})
+        SM.zimbra_soap_get_contacts_by_ids(
+            SOAP_URL, auth_token="token", ids=["1", "2"], verify_tls=True, soap_format="json"
+        )
+        envelope = self.json_requests[0]
+        self.assertEqual(envelope["Header"]["context"]["authToken"], {"_content": "token"})
+        self.assertEqual(envelope["Header"]["context"]["format"], {"type": "js"})
+        self.assertEqual(
+            envelope["Body"]["GetContactsRequest"],
+            {"_jsns": "urn:zimbraMail", "cn": [{"id": "1"}, {"id": "2"}]},
+        )
+
+    def test_get_contacts_matches_xml_shape(self) -> None:
+        self.respond(
+            "GetContactsResponse",
+            {
+                "cn": [
+                    {
+                        "id": "19959",
+                        "l": "7",
+                        "_attrs": {"type": "group", "nickname": "group_user", "email": ["a@x", "b@x"]},
+                        "m": [
+                            {"type": "I", "value": '"user" <user@example.com>'},
+                            {"t": "I", "v": "user@example.com"},
+                        ],
+                    },
+                    {"id": "20000", "a": [{"n": "firstName", "_content": "Ada"}]},
+                ],
+                "_jsns": "urn:zimbraMail",
+            },
+        )
+        contacts = SM.zimbra_soap_get_contacts_by_ids(
+            SOAP_URL, auth_token="token", ids=["19959", "20000"], verify_tls=True, soap_format="json"
+        )
+        self.assertEqual([c.contact_id for c in contacts], ["19959", "20000"])
+        self.assertEqual(contacts[0].folder_id, "7")
+        self.assertEqual(contacts[0].attrs, {"type": "group", "nickname": "group_user", "email": "b@x"})
+        self.assertEqual(
+            [m.value for m in contacts[0].members],
+            ['"user" <user@example.com>', "user@example.com"],
+        )
+        self.assertIsNone(contacts[1].folder_id)
+        self.assertEqual(contacts[1].attrs, {"firstName": "Ada"})
+
+    def test_search_ids_and_more_flag(self) -> None:
+        self.respond("SearchResponse", {"more": True, "hit": [{"id": "3"}, {"id": "4"}], "cn": [{"id": "3"}]})
+        ids, more = SM.zimbra_soap_search_contact_ids(
+            SOAP_URL, auth_token="t", folder_id="7", limit=2, offset=0, verify_tls=True, soap_format="json"
+        )
+        self.assertEqual((ids, more), (["3", "4"], True))
+        self.assertEqual(self.json_requests[0]["Body"]["SearchRequest"]["query"], "inid:7")
+
+    def test_folders_are_found_at_any_depth(self) -> None:
+        self.respond(
+            "GetFolderResponse",
+            {
+                "folder": [
+                    {
+                        "id": "1",
+                        "name": "USER_ROOT",
+                        "folder": [
+                            {"id": "7", "name": "Contacts", "view": "contact", "absFolderPath": "/Contacts"},
+                            {"id": "10", "name": "Calendar", "view": "appointment", "absFolderPath": "/Calendar"},
+                            {
+                                "id": "20",
+                                "name": "Work",
+                                "view": "contact",
+                                "folder": [{"id": "21", "name": "Team", "view": "contact"}],
+                            },
+                        ],
+                    }
+                ]
+            },
+        )
+        folders = SM.zimbra_soap_get_contact_folders(SOAP_URL, auth_token="t", verify_tls=True, soap_format="json")
+        self.assertEqual(
+            [(f.folder_id, f.abs_folder_path) for f in folders],
+            [("7", "/Contacts"), ("20", "/Work"), ("21", "/Team")],
+        )
+
+    def test_filter_rules_match_xml_shape(self) -> None:
+        self.respond(
+            "GetFilterRulesResponse",
+            {
+                "filterRules": [
+                    {
+                        "filterRule": [
+                            {
+                                "name": "Lists",
+                                "active": False,
+                                "filterTests": [
+                                    {
+                                        "condition": "anyof",
+                                        "headerTest": [
+                                            {"index": 0, "header": "list-id", "stringComparison": "contains", "value": "x"}
+                                        ],
+                                    }
+                                ],
+                                "filterActions": [{"actionFileInto": [{"index": 0, "folderPath": "Lists"}], "actionStop": {}}],
+                            }
+                        ]
+                    }
+                ]
+            },
+        )
+        rules = SM.zimbra_soap_get_filter_rules(SOAP_URL, auth_token="t", verify_tls=True, soap_format="json")
+        self.assertEqual(
+            rules,
+            [
+                {
+                    "name": "Lists",
+                    "active": False,
+                    "filterTests": [
+                        {
+                            "condition": "anyof",
+                            "headerTest": [
+                                {"index": "0", "header": "list-id", "stringComparison": "contains", "value": "x"}
+                            ],
+                        }
+                    ],
+                    "filterActions": [{"actionFileInto": [{"index": "0", "folderPath": "Lists"}], "actionStop": [{}]}],
+                }
+            ],
+        )
+
+    def test_unusable_json_falls_back_to_xml_once(self) -> None:
+        self.json_response = b"<soap:Envelope/>"
+        xml_calls: list[bytes] = []
+
+        def fake_http_post_xml(_url, body, verify_tls):  # noqa: ANN001
+            xml_calls.append(body)
+            return b'<Envelope><Body><GetTagResponse><tag id="64" name="Work" color="3"/></GetTagResponse></Body></Envelope>'
+
+        SM.http_post_xml = fake_http_post_xml  # type: ignore[assignment]
+        for _ in range(2):
+            tags = SM.zimbra_soap_get_tags(SOAP_URL, auth_token="t", verify_tls=True, soap_format="json")
+            self.assertEqual(tags, [SM.ZimbraTag(soap_id="64", name="Work", color="3")])
+        self.assertEqual(len(self.json_requests), 1)
+        self.assertEqual(len(xml_calls), 2)
+        self.assertIn(b"<GetTagRequest", xml_calls[0])
+
+
+    def test_batch_returns_results_in_order_with_faults(self) -> None:
+        self.respond(
+            "BatchResponse",
+            {
+                "_jsns": "urn:zimbra",
+                # Grouped by element name, not in request order.
+                "SearchResponse": [{"requestId": "2", "more": False, "hit": [{"id": "9"}]}],
+                "Fault": [
+                    {
+                        "requestId": "1",
+                        "Code": {"Value": "soap:Sender"},
+                        "Reason": {"Text": "no such folder id: 99"},
+                        "Detail": {"Error": {"Code": "mail.NO_SUCH_FOLDER", "_jsns": "urn:zimbra"}},
+                    }
+                ],
+                "GetTagResponse": [{"requestId": "0", "tag": [{"id": "64", "name": "Work"}]}],
+            },
+        )
+        results = SM.zimbra_soap_batch(
+            SOAP_URL,
+            [
+                SM.zimbra_soap_get_tags_request(),
+                SM.zimbra_soap_search_contact_ids_request(folder_id="99", limit=10, offset=0),
+                SM.zimbra_soap_search_contact_ids_request(folder_id="7", limit=10, offset=0),
+            ],
+            auth_token="t",
+            verify_tls=True,
+            soap_format="json",
+        )
+        self.assertEqual(len(self.json_requests), 1)
+        batch = self.json_requests[0]["Body"]["BatchRequest"]
+        self.assertEqual(batch["onerror"], "continue")
+        self.assertEqual([r["requestId"] for r in batch["SearchRequest"]], ["1", "2"])
+
+        self.assertEqual(results[0], [SM.ZimbraTag(soap_id="64", name="Work", color=None)])
+        self.assertIsInstance(results[1], SM.ZimbraSoapFault)
+        self.assertEqual(results[1].code, "mail.NO_SUCH_FOLDER")
+        self.assertEqual(results[1].reason, "no such folder id: 99")
+        self.assertEqual(results[2], (["9"], False))
+
+    def test_batch_xml(self) -> None:
+        xml_calls: list[bytes] = []
+
+        def fake_http_post_xml(_url, body, verify_tls):  # noqa: ANN001
+            xml_calls.append(body)
+            return b"""\
+<soap:Envelope xmlns:soap="http://www.w3.org/2003/05/soap-envelope">
+  <soap:Body>
+    <BatchResponse xmlns="urn:zimbra">
+      <soap:Fault requestId="1">
+        <soap:Code><soap:Value>soap:Sender</soap:Value></soap:Code>
+        <soap:Reason><soap:Text>no such contact: 5</soap:Text></soap:Reason>
+        <soap:Detail><Error xmlns="urn:zimbra"><Code>mail.NO_SUCH_CONTACT</Code></Error></soap:Detail>
+      </soap:Fault>
+      <GetContactsResponse xmlns="urn:zimbraMail" requestId="0">
+        <cn id="4" l="7"><a n="firstName">Ada</a></cn>
+      </GetContactsResponse>
+    </BatchResponse>
+  </soap:Body>
+</soap:Envelope>
+"""
+
+        SM.http_post_xml = fake_http_post_xml  # type: ignore[assignment]
+        results = SM.zimbra_soap_batch(
+            SOAP_URL,
+            [
+                SM.zimbra_soap_get_contacts_by_ids_request(ids=["4"]),
+                SM.zimbra_soap_get_contacts_by_ids_request(ids=["5"]),
+            ],
+            auth_token="t",
+            verify_tls=True,
+            soap_format="xml",
+        )
+        self.assertIn(b'<BatchRequest xmlns="urn:zimbra" onerror="continue">', xml_calls[0])
+        self.assertIn(b'<GetContactsRequest requestId="1" xmlns="urn:zimbraMail">', xml_calls[0])
+        self.assertEqual([c.contact_id for c in results[0]], ["4"])
+        self.assertEqual(str(results[1]), "GetContactsRequest failed: mail.NO_SUCH_CONTACT: no such contact: 5")
+
+
+    def test_contacts_stream_out_of_xml(self) -> None:
+        raw = b"""\
+<Envelope><Body><GetContactsResponse xmlns="urn:zimbraMail">
+  <cn id="1" l="7"><a n="firstName">Ada</a></cn>
+  <cn><a n="firstName">no id</a></cn>
+  <cn id="2" l="7"><a n="firstName">Grace</a></cn>
+</GetContactsResponse></Body></Envelope>
+"""
+        contacts = SM.iter_zimbra_contacts_xml(raw)
+        first = next(contacts)
+        self.assertEqual((first.contact_id, first.attrs), ("1", {"firstName": "Ada"}))
+        self.assertEqual([c.contact_id for c in contacts], ["2"])
+
+        with self.assertRaises(SystemExit):
+            list(SM.iter_zimbra_contacts_xml(b"<Envelope><Body><Other/></Body></Envelope>"))
+
+    def test_iter_contacts_by_ids_is_lazy(self) -> None:
+        self.respond("GetContactsResponse", {"cn": [{"id": "1"}, {"id": "2"}]})
+        contacts = SM.zimbra_soap_iter_contacts_by_ids(
+            SOAP_URL, auth_token="t", ids=["1", "2"], verify_tls=True, soap_format="json"
+        )
+        self.assertEqual(self.json_requests, [])
+        self.assertEqual([c.contact_id for c in contacts], ["1", "2"])
+        self.assertEqual(len(self.json_requests), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()